@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from urllib import request
+
+from benchmark.standin import serve
+
+STAGES = {
+    "threads": {
+        "sitemap_and_import": "_import_events_from_sitemap",
+        "fetch_and_parse": "_load_event",
+        "api_write": "_write_event",
+        "purge": "_purge_events",
+    },
+    "async": {
+        "sitemap_and_import": "_import_events_from_sitemap",
+        "fetch_and_parse": "_load_event_async",
+        "api_write": "_write_event_async",
+        "purge": "_purge_events",
+    },
+}
+
+
+class StageTimer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+
+    def wrap(self, importer, stage: str, method_name: str):
+        method = getattr(importer, method_name)
+
+        async def timed_async(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self._add(stage, time.perf_counter() - start)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._add(stage, time.perf_counter() - start)
+
+        if asyncio.iscoroutinefunction(method):
+            setattr(importer, method_name, timed_async)
+        else:
+            setattr(importer, method_name, timed)
+
+    def _add(self, stage: str, duration: float):
+        with self.lock:
+            self.durations[stage].append(duration)
+
+    def report(self) -> dict:
+        result = dict()
+
+        for stage, durations in self.durations.items():
+            durations = sorted(durations)
+            result[stage] = {
+                "count": len(durations),
+                "total_s": round(sum(durations), 4),
+                "p50_ms": round(statistics.median(durations) * 1000, 2),
+                "p95_ms": round(durations[int(len(durations) * 0.95)] * 1000, 2),
+                "max_ms": round(durations[-1] * 1000, 2),
+            }
+
+        return result
+
+
+def _start_standin(args) -> str:
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=serve,
+        args=(child_connection, args.events, args.api_latency, args.page_latency),
+        daemon=True,
+    )
+    process.start()
+    port = parent_connection.recv()
+    return f"http://127.0.0.1:{port}"
+
+
+def _configure_environment(base_url: str):
+    os.environ["HARZINFO_URL"] = base_url
+    os.environ["API_URL"] = base_url
+    os.environ["AUTHLIB_INSECURE_TRANSPORT"] = "1"
+    os.environ.setdefault("ORGANIZATION_ID", "1")
+    os.environ.setdefault("CLIENT_ID", "benchmark")
+    os.environ.setdefault("CLIENT_SECRET", "benchmark")
+    os.environ.setdefault("ACCESS_TOKEN", "benchmark")
+    os.environ.setdefault("REFRESH_TOKEN", "benchmark")
+    os.environ.setdefault("PAGE_CACHE_PATH", "")
+
+    redis_url = os.getenv("BENCHMARK_REDIS_URL")
+    os.environ["REDIS_URL"] = redis_url or "redis://localhost:6379/0"
+
+    import project
+
+    project.configure_logging()
+
+    if redis_url:
+        project.r.flushdb()
+    else:
+        import fakeredis
+
+        project.r = fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+def _control(base_url: str, path: str):
+    if path == "stats":
+        with request.urlopen(f"{base_url}/_control/stats") as response:
+            return json.loads(response.read())
+
+    request.urlopen(request.Request(f"{base_url}/_control/{path}", data=b""))
+
+
+def _run_scenario(name: str, base_url: str, engine: str, trace_memory: bool) -> dict:
+    from project.metrics import metrics
+
+    if engine == "async":
+        from project.async_importer import AsyncImporter as Importer
+    else:
+        from project.importer import Importer
+
+    api_requests_before = _control(base_url, "stats")
+
+    # Started per scenario, so the peak covers only this run
+    if trace_memory:
+        tracemalloc.start()
+
+    importer = Importer()
+    timer = StageTimer()
+
+    for stage, method_name in STAGES[engine].items():
+        timer.wrap(importer, stage, method_name)
+
+    start = time.perf_counter()
+    importer.run()
+    duration = time.perf_counter() - start
+    peak_traced_kb = None
+
+    if trace_memory:
+        peak_traced_kb = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+
+    api_requests_after = _control(base_url, "stats")
+    processed = (
+        importer.unchanged_event_count
+        + importer.new_event_count
+        + importer.updated_event_count
+    )
+
+    return {
+        "scenario": name,
+        "engine": engine,
+        "duration_s": round(duration, 3),
+        "events_per_s": round(processed / duration, 1) if duration else None,
+        "events": {
+            "unchanged": importer.unchanged_event_count,
+            "new": importer.new_event_count,
+            "updated": importer.updated_event_count,
+            "deleted": importer.deleted_event_count,
+            "failed": importer.failed_event_count,
+        },
+        "api_requests": {
+            method: count - api_requests_before.get(method, 0)
+            for method, count in api_requests_after.items()
+        },
+        "harzinfo": importer.harzinfo_loader.connection_stats(),
+        "stages": timer.report(),
+        "peak_traced_kb": peak_traced_kb,
+        "metrics": metrics.report(),
+    }
+
+
+def _print_result(result: dict):
+    peak = ""
+
+    if result["peak_traced_kb"] is not None:
+        peak = f"peak {result['peak_traced_kb'] / 1024:.1f} MiB  "
+
+    print(
+        f"{result['scenario']:<12} {result['duration_s']:>8.3f}s "
+        f"{result['events_per_s'] or 0:>9.1f} events/s  {peak}{result['events']}"
+    )
+
+    for stage, stats in result["stages"].items():
+        print(
+            f"    {stage:<20} n={stats['count']:<6} total={stats['total_s']:.3f}s "
+            f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms max={stats['max_ms']}ms"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure the importer against a local harzinfo/Oveda stand-in"
+    )
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument(
+        "--api-latency", type=float, default=0.02, help="seconds per API request"
+    )
+    parser.add_argument(
+        "--page-latency", type=float, default=0.01, help="seconds per event page"
+    )
+    parser.add_argument(
+        "--changed", type=float, default=0.1, help="share of changed events"
+    )
+    parser.add_argument(
+        "--removed", type=float, default=0.01, help="share of removed events"
+    )
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads")
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="trace the peak memory of each run, slows the runs down",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    base_url = _start_standin(args)
+    _configure_environment(base_url)
+
+    results = list()
+    results.append(_run_scenario("cold", base_url, args.engine, args.trace_memory))
+    results.append(
+        _run_scenario("not_modified", base_url, args.engine, args.trace_memory)
+    )
+    _control(base_url, f"touch?count={args.events}")
+    results.append(_run_scenario("warm", base_url, args.engine, args.trace_memory))
+    _control(base_url, f"change?count={int(args.events * args.changed)}")
+    _control(base_url, f"remove?count={int(args.events * args.removed)}")
+    results.append(
+        _run_scenario("incremental", base_url, args.engine, args.trace_memory)
+    )
+
+    for result in results:
+        _print_result(result)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
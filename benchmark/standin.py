@@ -0,0 +1,272 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StandinState:
+    """Synthetic harzinfo.de sitemap and event pages plus a fake Oveda API."""
+
+    def __init__(self, event_count: int, api_latency: float, page_latency: float):
+        self.event_count = event_count
+        self.api_latency = api_latency
+        self.page_latency = page_latency
+        self.lock = threading.Lock()
+        self.versions = [0] * event_count
+        self.renders = [0] * event_count
+        self.lastmods = ["2021-01-01T00:00:00+01:00"] * event_count
+        self.removed = set()
+        self.next_id = 0
+        self.entities = {"places": dict(), "organizers": dict(), "events": dict()}
+        self.requests = Counter()
+
+    def change(self, count: int):
+        lastmod = datetime.now(tz=timezone.utc).isoformat()
+        step = max(1, self.event_count // max(1, count))
+
+        with self.lock:
+            for i in range(0, self.event_count, step)[:count]:
+                self.versions[i] = self.versions[i] + 1
+                self.lastmods[i] = lastmod
+
+    def touch(self, count: int):
+        # Changes the lastmod, but not the event. Every second touched page
+        # is rendered again with a new ETag, the others stay byte-identical.
+        lastmod = datetime.now(tz=timezone.utc).isoformat()
+
+        with self.lock:
+            for i in range(min(count, self.event_count)):
+                self.lastmods[i] = lastmod
+
+                if i % 2:
+                    self.renders[i] = self.renders[i] + 1
+
+    def remove(self, count: int):
+        with self.lock:
+            for i in range(self.event_count - 1, -1, -1):
+                if len(self.removed) >= count:
+                    break
+                self.removed.add(i)
+
+    def new_id(self) -> int:
+        with self.lock:
+            self.next_id = self.next_id + 1
+            return self.next_id
+
+    def sitemap(self, base_url: str) -> str:
+        urls = "".join(
+            f"<url><loc>{base_url}/event/{i}</loc><lastmod>{self.lastmods[i]}</lastmod></url>"
+            for i in range(self.event_count)
+            if i not in self.removed
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            f"{urls}</urlset>"
+        )
+
+    def event_page(self, i: int) -> str:
+        ld_json = {
+            "@context": "https://schema.org",
+            "@type": ["Event", "MusicEvent" if i % 2 else "TheaterEvent"],
+            "identifier": [f"benchmark-{i}"],
+            "url": f"https://www.example.com/events/{i}",
+            "name": f" Event {i} (version {self.versions[i]}) ",
+            "startDate": "2031-01-01T20:00:00+01:00",
+            "description": f"First line &amp; more<br>Second <b>line</b> of event {i}<br/>Last line",
+            "image": [
+                {
+                    "url": f"https://www.example.com/images/{i}.jpg",
+                    "contributor": "Harzer Tourismusverband",
+                }
+            ],
+            "eventStatus": "EventScheduled",
+            "keywords": "Konzert, draussen, Familie",
+            "author": {"name": "Harzer Tourismusverband"},
+            "organizer": [{"name": f"Organizer {i % 40}", "email": "info@example.com"}],
+            "location": [
+                {
+                    "name": f"Venue {i % 60}",
+                    "address": {
+                        "streetAddress": "Markt 1",
+                        "postalCode": "38640",
+                        "addressLocality": "Goslar",
+                        "addressCountry": "DE",
+                    },
+                }
+            ],
+            "offers": {"price": str(i % 30)},
+        }
+        filler = "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 200
+        return (
+            "<!DOCTYPE html><html><head><title>Event</title>"
+            '<script src="/main.js"></script>'
+            f'<script type="application/ld+json">{json.dumps([ld_json])}</script>'
+            f"</head><body><nav>{filler}</nav>"
+            f'<div class="map" data-position="51.9{i % 100:02d},10.4{i % 97:02d}"></div>'
+            f'<footer data-render="{self.renders[i]}">{filler}</footer></body></html>'
+        )
+
+
+def _create_handler(state: StandinState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+
+            if path == "/sitemap.xml":
+                base_url = f"http://{self.headers['Host']}"
+                return self._send_page(state.sitemap(base_url), "application/xml")
+
+            match = re.match(r"^/event/(\d+)$", path)
+            if match:
+                time.sleep(state.page_latency)
+                return self._send_page(
+                    state.event_page(int(match.group(1))), "text/html"
+                )
+
+            if path == "/_control/stats":
+                return self._send_json(200, dict(state.requests))
+
+            self._handle_api("GET")
+
+        def do_POST(self):
+            url = urlparse(self.path)
+
+            if url.path == "/oauth/token":
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                return self._send_json(
+                    200,
+                    {
+                        "access_token": "benchmark",
+                        "refresh_token": "benchmark",
+                        "token_type": "Bearer",
+                        "expires_in": 3600,
+                    },
+                )
+
+            if url.path.startswith("/_control/"):
+                count = int(parse_qs(url.query)["count"][0])
+                getattr(state, url.path[len("/_control/") :])(count)
+                return self._send_json(204)
+
+            self._handle_api("POST")
+
+        def do_PUT(self):
+            self._handle_api("PUT")
+
+        def do_PATCH(self):
+            self._handle_api("PATCH")
+
+        def do_DELETE(self):
+            self._handle_api("DELETE")
+
+        def _handle_api(self, method: str):
+            time.sleep(state.api_latency)
+            url = urlparse(self.path)
+            path = url.path[len("/api/v1") :]
+            query = parse_qs(url.query)
+            state.requests[method] += 1
+
+            if path == "/event-categories":
+                names = ["Music", "Theater", "Family", "Other"]
+                items = [{"id": i, "name": n} for i, n in enumerate(names)]
+                return self._send_json(200, {"items": items, "has_next": False})
+
+            match = re.match(r"^/organizations/\d+/(places|organizers|events)$", path)
+            if match:
+                entities = state.entities[match.group(1)]
+
+                if method == "GET":
+                    return self._send_pagination(entities, query)
+
+                entity_id = state.new_id()
+                entities[entity_id] = self._read_body()
+                return self._send_json(201, {"id": entity_id})
+
+            match = re.match(r"^/(places|organizers|events)/(\d+)$", path)
+            if match:
+                entities = state.entities[match.group(1)]
+                entity_id = int(match.group(2))
+
+                if entity_id not in entities:
+                    return self._send_json(404, {})
+
+                if method == "DELETE":
+                    del entities[entity_id]
+                elif method == "PATCH":
+                    entities[entity_id].update(self._read_body())
+                else:
+                    entities[entity_id] = self._read_body()
+
+                return self._send_json(204)
+
+            self._send_json(404, {})
+
+        def _send_pagination(self, entities: dict, query: dict):
+            name = query.get("name", [None])[0]
+            page = int(query.get("page", ["1"])[0])
+            per_page = int(query.get("per_page", ["20"])[0])
+            items = [
+                {"id": i, "name": e["name"]}
+                for i, e in list(entities.items())
+                if name is None or name.lower() in e["name"].lower()
+            ]
+            self._send_json(
+                200,
+                {
+                    "items": items[(page - 1) * per_page : page * per_page],
+                    "page": page,
+                    "per_page": per_page,
+                    "total": len(items),
+                    "has_next": page * per_page < len(items),
+                },
+            )
+
+        def _send_page(self, body: str, content_type: str):
+            data = body.encode("utf-8")
+            etag = f'"{hashlib.md5(data).hexdigest()}"'
+
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, b"", content_type, {"ETag": etag})
+
+            self._send(200, data, content_type, {"ETag": etag})
+
+        def _send_json(self, code: int, data: dict = None):
+            body = json.dumps(data).encode("utf-8") if data is not None else b""
+            self._send(code, body, "application/json")
+
+        def _send(self, code: int, body: bytes, content_type: str, headers=None):
+            self.send_response(code)
+
+            for key, value in (headers or dict()).items():
+                self.send_header(key, value)
+
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"null")
+
+    return Handler
+
+
+def serve(connection, event_count: int, api_latency: float, page_latency: float):
+    state = StandinState(event_count, api_latency, page_latency)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _create_handler(state))
+    server.daemon_threads = True
+    connection.send(server.server_address[1])
+    server.serve_forever()
@@ -0,0 +1,109 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules that must only be imported once they are needed
+LAZY_MODULES = [
+    "asyncio",
+    "authlib",
+    "bs4",
+    "cryptography",
+    "httpx",
+    "redis",
+    "validators",
+]
+
+
+def _measure(module: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = dict()
+    total = 0
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        modules[name] = int(cumulative)
+
+        if depth == 0:
+            total = total + int(cumulative)
+
+    return {"total_us": total, "modules": modules}
+
+
+def _print_result(module: str, result: dict, top: int):
+    print(f"import {module}: {result['total_us'] / 1000:.1f} ms")
+
+    top_modules = sorted(result["modules"].items(), key=lambda item: -item[1])
+
+    for name, cumulative in top_modules[:top]:
+        print(f"    {name:40} {cumulative / 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the import time of the importer with -X importtime"
+    )
+    parser.add_argument("--module", default="project.importer")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=None,
+        help="fail if the fastest import takes longer",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    # The first import compiles the byte code, it is not measured
+    _measure(args.module)
+    results = [_measure(args.module) for _ in range(args.repeat)]
+    best = min(results, key=lambda result: result["total_us"])
+    _print_result(args.module, best, args.top)
+
+    errors = list()
+    eager = [name for name in LAZY_MODULES if name in best["modules"]]
+
+    if eager:
+        errors.append(f"Imported although they should load lazily: {', '.join(eager)}")
+
+    if args.budget_ms is not None and best["total_us"] / 1000 > args.budget_ms:
+        errors.append(
+            f"Import took {best['total_us'] / 1000:.1f} ms, budget is {args.budget_ms} ms"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "module": args.module,
+                    "best_ms": best["total_us"] / 1000,
+                    "runs_ms": [result["total_us"] / 1000 for result in results],
+                    "eager_modules": eager,
+                    "modules_ms": {
+                        name: cumulative / 1000
+                        for name, cumulative in best["modules"].items()
+                    },
+                },
+                f,
+                indent=2,
+            )
+
+    for error in errors:
+        print(error, file=sys.stderr)
+
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,7 @@
 #!/usr/bin/env bash
 
+if [[ "${DAEMON,,}" == "true" || "${DAEMON}" == "1" ]]; then
+    exec python import.py --daemon ${IMPORT_ARGS}
+fi
+
 python idle.py
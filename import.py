@@ -1,4 +1,54 @@
-from project.importer import Importer
+import argparse
 
-importer = Importer()
-importer.run()
+from project import configure_logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import harzinfo.de events into Oveda")
+    parser.add_argument(
+        "--mode",
+        choices=["single", "coordinator", "worker"],
+        default="single",
+        help="single imports in this process, coordinator and worker split a run across processes",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="how pages are fetched and events are written in single mode",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running and import every DAEMON_INTERVAL seconds",
+    )
+    args = parser.parse_args()
+    configure_logging()
+
+    if args.mode == "worker":
+        if args.daemon:
+            parser.error("workers keep running anyway, --daemon is not needed")
+
+        from project.distributed import run_worker
+
+        run_worker()
+    else:
+        if args.mode == "coordinator":
+            from project.distributed import Coordinator as importer_class
+        elif args.engine == "async":
+            from project.async_importer import AsyncImporter as importer_class
+        else:
+            from project.importer import Importer as importer_class
+
+        if args.daemon:
+            from project.daemon import Daemon
+
+            Daemon(importer_class).run()
+        else:
+            importer = importer_class()
+            importer.run()
+
+
+# Guarded, because the processes of CPU_WORKERS import this module again
+if __name__ == "__main__":
+    main()
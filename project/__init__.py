@@ -1,18 +1,39 @@
 import logging
 import os
-from datetime import datetime
-from urllib.parse import urlparse
+import threading
 
 import pytz
-import redis
 
-log_level = os.getenv("LOG_LEVEL", "ERROR").upper()
-logging.basicConfig(
-    level=log_level, format="%(asctime)s | %(name)s | %(levelname)s | %(message)s"
-)
 logger = logging.getLogger(__name__)
 
-r = redis.from_url(os.getenv("REDIS_URL"), charset="utf-8", decode_responses=True)
+
+def configure_logging():
+    log_level = os.getenv("LOG_LEVEL", "ERROR").upper()
+    logging.basicConfig(
+        level=log_level, format="%(asctime)s | %(name)s | %(levelname)s | %(message)s"
+    )
+
+
+class LazyRedis:
+    """Connects to REDIS_URL on first use, so that importing is cheap."""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import redis
+
+                    self._client = redis.from_url(
+                        os.getenv("REDIS_URL"), charset="utf-8", decode_responses=True
+                    )
+
+        return getattr(self._client, name)
+
+
+r = LazyRedis()
 
 berlin_tz = pytz.timezone("Europe/Berlin")
-now = datetime.now(tz=berlin_tz)
@@ -1,13 +1,35 @@
 import os
+import threading
+from urllib.parse import quote
 
 from project import logger
-from project.session_client import SessionClient, UnprocessableEntityError
+from project.session_client import (
+    NotFoundError,
+    SessionClient,
+    UnprocessableEntityError,
+)
 
 
 class ApiClient:
     def __init__(self):
-        self.session_client = SessionClient()
+        self._session_client = None
+        self.session_client_lock = threading.Lock()
         self.organization_id = os.getenv("ORGANIZATION_ID")
+        self.per_page = int(os.getenv("API_PER_PAGE", "500"))
+        self.indexes = dict()
+
+    @property
+    def session_client(self) -> SessionClient:
+        # Created on first use, which a run without changes never gets to
+        if self._session_client is None:
+            with self.session_client_lock:
+                if self._session_client is None:
+                    self._session_client = self._create_session_client()
+
+        return self._session_client
+
+    def _create_session_client(self) -> SessionClient:
+        return SessionClient()
 
     def get_categories(self) -> int:
         logger.debug("Get categories")
@@ -15,12 +37,25 @@ class ApiClient:
         pagination = response.json()
         return pagination["items"]
 
+    def load_indexes(self):
+        for entity_type in ["organizers", "places"]:
+            index = dict()
+
+            for item in self._iterate_pagination(
+                f"/organizations/{self.organization_id}/{entity_type}"
+            ):
+                index[item["name"]] = item["id"]
+
+            logger.debug(f"Loaded {len(index)} {entity_type} into index")
+            self.indexes[entity_type] = index
+
     def insert_organizer(self, data: dict) -> int:
         logger.debug(f"Insert organizer {data['name']}")
         response = self.session_client.post(
             f"/organizations/{self.organization_id}/organizers", data=data
         )
         organizer = response.json()
+        self._add_to_index("organizers", data["name"], organizer["id"])
         return organizer["id"]
 
     def update_organizer(self, organizer_id: int, data: dict):
@@ -30,11 +65,7 @@ class ApiClient:
     def upsert_organizer(self, data: dict) -> int:
         name = data["name"]
         logger.debug(f"Upsert organizer {name}")
-        response = self.session_client.get(
-            f"/organizations/{self.organization_id}/organizers?name={name}"
-        )
-        pagination = response.json()
-        organizer = self._find_item_in_pagination(pagination, name)
+        organizer = self._find_item("organizers", name)
 
         if not organizer:
             logger.debug(f"Organizer {name} does not exist")
@@ -52,6 +83,7 @@ class ApiClient:
             f"/organizations/{self.organization_id}/places", data=data
         )
         place = response.json()
+        self._add_to_index("places", data["name"], place["id"])
         return place["id"]
 
     def update_place(self, place_id: int, data: dict):
@@ -61,12 +93,7 @@ class ApiClient:
     def upsert_place(self, data: dict) -> int:
         name = data["name"]
         logger.debug(f"Upsert place {name}")
-
-        response = self.session_client.get(
-            f"/organizations/{self.organization_id}/places?name={name}"
-        )
-        pagination = response.json()
-        place = self._find_item_in_pagination(pagination, name)
+        place = self._find_item("places", name)
 
         if not place:
             logger.debug(f"Place {name} does not exist")
@@ -110,13 +137,62 @@ class ApiClient:
             else:
                 raise
 
+    def patch_event(self, event_id: int, data: dict):
+        logger.debug(f"Patch event {event_id} {', '.join(data.keys())}")
+
+        try:
+            self.session_client.patch(f"/events/{event_id}", data=data)
+        except UnprocessableEntityError as e:
+            if e.json["errors"][0]["field"] == "photo":
+                logger.warn("Retrying without photo")
+                del data["photo"]
+
+                if data:
+                    self.session_client.patch(f"/events/{event_id}", data=data)
+            else:
+                raise
+
     def delete_event(self, event_id: int):
         logger.debug(f"Delete event {event_id}")
-        self.session_client.delete(f"/events/{event_id}")
 
-    def _find_item_in_pagination(self, pagination: dict, name: str) -> dict:
-        for item in pagination["items"]:
+        try:
+            self.session_client.delete(f"/events/{event_id}")
+        except NotFoundError:
+            logger.debug(f"Event {event_id} does not exist anymore")
+
+    def _find_item(self, entity_type: str, name: str) -> dict:
+        index = self.indexes.get(entity_type)
+
+        if index is not None and name in index:
+            return {"id": index[name], "name": name}
+
+        for item in self._iterate_pagination(
+            f"/organizations/{self.organization_id}/{entity_type}?name={quote(name)}"
+        ):
             if item["name"] == name:
+                self._add_to_index(entity_type, name, item["id"])
                 return item
 
         return None
+
+    def _add_to_index(self, entity_type: str, name: str, item_id: int):
+        index = self.indexes.get(entity_type)
+
+        if index is not None:
+            index[name] = item_id
+
+    def _iterate_pagination(self, url: str):
+        separator = "&" if "?" in url else "?"
+        page = 1
+
+        while True:
+            response = self.session_client.get(
+                f"{url}{separator}page={page}&per_page={self.per_page}"
+            )
+            pagination = response.json()
+            yield from pagination["items"]
+
+            if not pagination.get("has_next", False):
+                break
+
+            page = page + 1
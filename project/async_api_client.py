@@ -0,0 +1,191 @@
+from urllib.parse import quote
+
+from project import logger
+from project.api_client import ApiClient
+from project.async_session_client import AsyncSessionClient
+from project.session_client import (
+    NotFoundError,
+    SessionClient,
+    UnprocessableEntityError,
+)
+
+
+class AsyncApiClient(ApiClient):
+    """ApiClient with coroutines on an AsyncSessionClient.
+
+    The token is shared with the session client of the blocking ApiClient.
+    Create it inside the running event loop and close() it there.
+    """
+
+    def __init__(self, token_client: SessionClient):
+        super().__init__()
+        self.token_client = token_client
+
+    def _create_session_client(self) -> AsyncSessionClient:
+        return AsyncSessionClient(self.token_client)
+
+    async def close(self):
+        if self._session_client:
+            await self._session_client.close()
+
+    async def get_categories(self) -> int:
+        logger.debug("Get categories")
+        response = await self.session_client.get("/event-categories?per_page=50")
+        pagination = response.json()
+        return pagination["items"]
+
+    async def load_indexes(self):
+        for entity_type in ["organizers", "places"]:
+            index = dict()
+
+            async for item in self._iterate_pagination(
+                f"/organizations/{self.organization_id}/{entity_type}"
+            ):
+                index[item["name"]] = item["id"]
+
+            logger.debug(f"Loaded {len(index)} {entity_type} into index")
+            self.indexes[entity_type] = index
+
+    async def insert_organizer(self, data: dict) -> int:
+        logger.debug(f"Insert organizer {data['name']}")
+        response = await self.session_client.post(
+            f"/organizations/{self.organization_id}/organizers", data=data
+        )
+        organizer = response.json()
+        self._add_to_index("organizers", data["name"], organizer["id"])
+        return organizer["id"]
+
+    async def update_organizer(self, organizer_id: int, data: dict):
+        logger.debug(f"Update organizer {organizer_id} {data['name']}")
+        await self.session_client.put(f"/organizers/{organizer_id}", data=data)
+
+    async def upsert_organizer(self, data: dict) -> int:
+        name = data["name"]
+        logger.debug(f"Upsert organizer {name}")
+        organizer = await self._find_item("organizers", name)
+
+        if not organizer:
+            logger.debug(f"Organizer {name} does not exist")
+            return await self.insert_organizer(data)
+
+        organizer_id = organizer["id"]
+        logger.debug(
+            f"Organizer {organizer_id} {name} already exists. No need to update."
+        )
+        return organizer_id
+
+    async def insert_place(self, data: dict) -> int:
+        logger.debug(f"Insert place {data['name']}")
+        response = await self.session_client.post(
+            f"/organizations/{self.organization_id}/places", data=data
+        )
+        place = response.json()
+        self._add_to_index("places", data["name"], place["id"])
+        return place["id"]
+
+    async def update_place(self, place_id: int, data: dict):
+        logger.debug(f"Update place {place_id} {data['name']}")
+        await self.session_client.put(f"/places/{place_id}", data=data)
+
+    async def upsert_place(self, data: dict) -> int:
+        name = data["name"]
+        logger.debug(f"Upsert place {name}")
+        place = await self._find_item("places", name)
+
+        if not place:
+            logger.debug(f"Place {name} does not exist")
+            return await self.insert_place(data)
+
+        place_id = place["id"]
+        logger.debug(f"Place {place_id} {name} already exists")
+        await self.update_place(place_id, data)
+        return place_id
+
+    async def insert_event(self, data: dict) -> int:
+        logger.debug(f"Insert event {data['name']}")
+
+        try:
+            response = await self.session_client.post(
+                f"/organizations/{self.organization_id}/events", data=data
+            )
+        except UnprocessableEntityError as e:
+            if e.json["errors"][0]["field"] == "photo":
+                logger.warn("Retrying without photo")
+                del data["photo"]
+                response = await self.session_client.post(
+                    f"/organizations/{self.organization_id}/events", data=data
+                )
+            else:
+                raise
+
+        event = response.json()
+        return event["id"]
+
+    async def update_event(self, event_id: int, data: dict):
+        logger.debug(f"Update event {event_id} {data['name']}")
+
+        try:
+            await self.session_client.put(f"/events/{event_id}", data=data)
+        except UnprocessableEntityError as e:
+            if e.json["errors"][0]["field"] == "photo":
+                logger.warn("Retrying without photo")
+                del data["photo"]
+                await self.session_client.put(f"/events/{event_id}", data=data)
+            else:
+                raise
+
+    async def patch_event(self, event_id: int, data: dict):
+        logger.debug(f"Patch event {event_id} {', '.join(data.keys())}")
+
+        try:
+            await self.session_client.patch(f"/events/{event_id}", data=data)
+        except UnprocessableEntityError as e:
+            if e.json["errors"][0]["field"] == "photo":
+                logger.warn("Retrying without photo")
+                del data["photo"]
+
+                if data:
+                    await self.session_client.patch(f"/events/{event_id}", data=data)
+            else:
+                raise
+
+    async def delete_event(self, event_id: int):
+        logger.debug(f"Delete event {event_id}")
+
+        try:
+            await self.session_client.delete(f"/events/{event_id}")
+        except NotFoundError:
+            logger.debug(f"Event {event_id} does not exist anymore")
+
+    async def _find_item(self, entity_type: str, name: str) -> dict:
+        index = self.indexes.get(entity_type)
+
+        if index is not None and name in index:
+            return {"id": index[name], "name": name}
+
+        async for item in self._iterate_pagination(
+            f"/organizations/{self.organization_id}/{entity_type}?name={quote(name)}"
+        ):
+            if item["name"] == name:
+                self._add_to_index(entity_type, name, item["id"])
+                return item
+
+        return None
+
+    async def _iterate_pagination(self, url: str):
+        separator = "&" if "?" in url else "?"
+        page = 1
+
+        while True:
+            response = await self.session_client.get(
+                f"{url}{separator}page={page}&per_page={self.per_page}"
+            )
+            pagination = response.json()
+
+            for item in pagination["items"]:
+                yield item
+
+            if not pagination.get("has_next", False):
+                break
+
+            page = page + 1
@@ -0,0 +1,102 @@
+import asyncio
+import os
+
+import httpx
+
+from project.harzinfo_loader import HarzinfoLoader, PageNotModified
+from project.metrics import metrics
+from project.page_cache import CachedPage
+
+
+class AsyncHarzinfoLoader(HarzinfoLoader):
+    """Fetches event pages with an httpx AsyncClient.
+
+    The sitemap is still loaded with the blocking session before the event
+    pages are fetched. Parsing is inherited. Use as async context manager.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.pool_size = int(os.getenv("HARZINFO_POOL_SIZE", "10"))
+        self.retries = int(os.getenv("HARZINFO_RETRIES", "3"))
+        self.backoff = float(os.getenv("HARZINFO_BACKOFF", "0.5"))
+        self.retry_status_codes = [500, 502, 504]
+        self.client = None
+
+    async def __aenter__(self):
+        limits = httpx.Limits(
+            max_connections=self.pool_size, max_keepalive_connections=self.pool_size
+        )
+        self.client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.client.aclose()
+
+    async def fetch_event(self, absolute_url: str, validators: dict = None):
+        if not self.conditional_get:
+            validators = None
+
+        if self.page_cache:
+            page = self.page_cache.get(absolute_url)
+
+            if not self._is_cache_hit(absolute_url, page):
+                page = await self._refresh_cached_page_async(absolute_url, page)
+
+            return self._read_cached_page(page, validators)
+
+        return await self._load_data_from_url_async(absolute_url, validators)
+
+    async def _refresh_cached_page_async(
+        self, absolute_url: str, page: CachedPage
+    ) -> CachedPage:
+        try:
+            data, validators = await self._load_data_from_url_async(
+                absolute_url, page.validators if page else None
+            )
+        except PageNotModified:
+            metrics.increment("page_cache", result="revalidated")
+            return self.page_cache.touch(page)
+
+        metrics.increment("page_cache", result="miss")
+        return self.page_cache.put(absolute_url, data, validators)
+
+    async def _load_data_from_url_async(
+        self, absolute_url: str, validators: dict = None
+    ):
+        response = await self._request_async(absolute_url, validators)
+        metrics.increment("harzinfo_bytes_downloaded", len(response.content))
+        return response.content, self._get_validators(response)
+
+    async def _request_async(
+        self, absolute_url: str, validators: dict = None
+    ) -> httpx.Response:
+        headers = self._get_request_headers(validators)
+
+        for attempt in range(self.retries + 1):
+            retry = attempt < self.retries
+
+            try:
+                with metrics.timer("fetch"):
+                    response = await self.limiter.request_async(
+                        lambda: self.client.get(absolute_url, headers=headers)
+                    )
+            except httpx.TransportError:
+                if not retry:
+                    raise
+            else:
+                metrics.increment(
+                    "harzinfo_requests", method="GET", status=response.status_code
+                )
+
+                if not retry or response.status_code not in self.retry_status_codes:
+                    break
+
+            metrics.increment("harzinfo_retries")
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+        if response.status_code == 304:
+            raise PageNotModified(absolute_url)
+
+        response.raise_for_status()
+        return response
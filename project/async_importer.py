@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+from collections import deque
+
+from project import logger
+from project.api_client import ApiClient
+from project.async_api_client import AsyncApiClient
+from project.async_harzinfo_loader import AsyncHarzinfoLoader
+from project.cpu_pool import ParsedPage
+from project.harzinfo_loader import HarzinfoLoader
+from project.importer import Importer
+from project.metrics import metrics
+
+
+class AsyncImporter(Importer):
+    """Importer that fetches pages and writes events with asyncio.
+
+    Up to FETCH_WORKERS pages are fetched and up to API_WORKERS events are
+    written at the same time on one thread. Parsing, checks and Redis writes
+    are the ones of the Importer. Everything that may read or write Redis
+    runs in the default executor, so that it does not stall the event loop.
+    The sitemap, categories, indexes and the purge still use the blocking
+    clients.
+    """
+
+    def __init__(
+        self, harzinfo_loader: HarzinfoLoader = None, api_client: ApiClient = None
+    ):
+        super().__init__(harzinfo_loader, api_client)
+        self.async_loader = None
+        self.async_api_client = None
+        self.async_entity_locks = dict()
+        self.fetch_semaphore = None
+        self.write_semaphore = None
+        self.loop = None
+
+    def _import_events(self, sitememap_urls):
+        # Created here, because it loads the token from Redis
+        token_client = self.api_client.session_client
+        asyncio.run(self._import_events_async(sitememap_urls, token_client))
+
+    async def _import_events_async(self, sitememap_urls, token_client):
+        # Clients, locks and semaphores have to be created in the running loop
+        self.loop = asyncio.get_running_loop()
+        self.fetch_semaphore = asyncio.Semaphore(self.fetch_workers)
+        self.write_semaphore = asyncio.Semaphore(self.api_workers)
+        self.async_entity_locks = dict()
+        self.async_api_client = AsyncApiClient(token_client)
+        self.async_api_client.indexes = self.api_client.indexes
+        fetches = deque()
+        writes = deque()
+
+        try:
+            with self._open_page_processor():
+                async with AsyncHarzinfoLoader() as self.async_loader:
+                    urls = self._prefetch_stored_state(sitememap_urls)
+
+                    while True:
+                        url, validators = await self._run_blocking(
+                            self._next_fetch, urls
+                        )
+
+                        if url is None:
+                            break
+
+                        task = asyncio.ensure_future(
+                            self._load_event_async(url, validators)
+                        )
+                        fetches.append((url, task))
+                        await self._process_pending_events_async(
+                            fetches,
+                            self._get_max_fetches(),
+                            writes,
+                            self.api_workers * 2,
+                        )
+
+                    await self._process_pending_events_async(fetches, 0, writes, 0)
+        finally:
+            await self.async_api_client.close()
+
+    async def _process_pending_events_async(
+        self, fetches: deque, max_fetches: int, writes: deque, max_writes: int
+    ):
+        while len(fetches) > max_fetches:
+            url, task = fetches.popleft()
+            await asyncio.wait([task])
+            write = await self._run_blocking(
+                self._import_fetched_event, url, task, self._submit_write_threadsafe
+            )
+
+            if write:
+                writes.append(write)
+
+            while len(writes) > max_writes:
+                await self._finish_event_write_async(*writes.popleft())
+
+        while len(writes) > max_writes:
+            await self._finish_event_write_async(*writes.popleft())
+
+    async def _finish_event_write_async(
+        self, url: str, uid: str, future, validators: dict
+    ):
+        await asyncio.wait([asyncio.wrap_future(future)])
+        await self._run_blocking(self._finish_event_write, url, uid, future, validators)
+
+    def _submit_write_threadsafe(self, *write_args) -> concurrent.futures.Future:
+        # Called by _import_fetched_event in the executor
+        return asyncio.run_coroutine_threadsafe(
+            self._write_event_async(*write_args), self.loop
+        )
+
+    async def _run_blocking(self, function, *args):
+        return await self.loop.run_in_executor(None, function, *args)
+
+    def _next_fetch(self, urls) -> tuple:
+        # Returns the next URL to fetch with its validators or None at the
+        # end. The checks and the prefetch read and write Redis.
+        for url, lastmod in urls:
+            if self._needs_fetch(url, lastmod):
+                return url, self._get_page_validators(url)
+
+        return None, None
+
+    async def _load_event_async(self, url: str, validators: dict):
+        async with self.fetch_semaphore:
+            html, validators = await self.async_loader.fetch_event(url, validators)
+
+        page = self._parse_page(html)
+
+        if self.page_processor:
+            page = await asyncio.wrap_future(page)
+
+        return page, validators
+
+    def _wait_for_page(self, page) -> ParsedPage:
+        # Pages from the page processor were already awaited in their task
+        return page
+
+    async def _write_event_async(
+        self, url: str, uid: str, projection: dict, item_hash: str, event_id: int
+    ) -> str:
+        async with self.write_semaphore:
+            with metrics.timer("event_write"):
+                return await self._write_event_to_api_async(
+                    url, uid, projection, item_hash, event_id
+                )
+
+    async def _write_event_to_api_async(
+        self, url: str, uid: str, projection: dict, item_hash: str, event_id: int
+    ) -> str:
+        organizer_id, place_id = await asyncio.gather(
+            self._import_entity_async("organizer", projection["organizer"]),
+            self._import_entity_async("place", projection["place"]),
+        )
+        event, field_hashes = self._build_event(projection, organizer_id, place_id)
+
+        if event_id > 0:
+            result = await self._update_event_async(uid, event_id, event, field_hashes)
+            await self._run_blocking(
+                self._store_event_hashes, uid, item_hash, field_hashes
+            )
+            return result
+        else:
+            logger.debug(f"Event for uid {uid} not in mapping. Inserting..")
+            event_id = await self.async_api_client.insert_event(event)
+            await self._run_blocking(
+                self._store_new_event, url, uid, event_id, item_hash, field_hashes
+            )
+            return "new"
+
+    async def _update_event_async(
+        self, uid: str, event_id: int, event: dict, field_hashes: dict
+    ) -> str:
+        changes = await self._run_blocking(
+            self._get_event_changes, uid, event, field_hashes
+        )
+
+        if changes is None:
+            logger.debug("Event did change. Updating..")
+            await self.async_api_client.update_event(event_id, event)
+            return "updated"
+
+        if not changes:
+            logger.debug("Event did not change in the fields sent. Nothing to do.")
+            return "unchanged"
+
+        logger.debug(f"Event did change in {', '.join(changes.keys())}. Patching..")
+        await self.async_api_client.patch_event(event_id, changes)
+        metrics.increment("event_patched_fields", len(changes))
+        return "updated"
+
+    async def _import_entity_async(self, entity_type: str, entity: dict) -> int:
+        hash_key = entity["name"]
+        entity_hash = self._hash_dict(entity)
+
+        # Same as _resolve_entity: each one is written at most once per run
+        cache_key = (entity_type, hash_key, entity_hash)
+        lock = self.async_entity_locks.setdefault(
+            (entity_type, hash_key), asyncio.Lock()
+        )
+
+        async with lock:
+            entity_id = self.resolved_entities.get(cache_key)
+
+            if entity_id is not None:
+                self._count_resolution(entity_type, "hits")
+                return entity_id
+
+            self._count_resolution(entity_type, "misses")
+            entity_id = await self._write_entity_async(
+                entity_type, hash_key, entity, entity_hash
+            )
+            self.resolved_entities[cache_key] = entity_id
+            return entity_id
+
+    async def _write_entity_async(
+        self, entity_type: str, hash_key: str, entity: dict, entity_hash: str
+    ) -> int:
+        entity_id, changed = await self._run_blocking(
+            self._check_entity, entity_type, hash_key, entity, entity_hash
+        )
+
+        if not changed:
+            return entity_id
+
+        update, upsert = self._get_entity_writers(self.async_api_client, entity_type)
+        inserted = entity_id is None
+
+        if inserted:
+            entity_id = await upsert(entity)
+        else:
+            await update(entity_id, entity)
+
+        await self._run_blocking(
+            self._store_entity, entity_type, hash_key, entity_id, entity_hash, inserted
+        )
+        return entity_id
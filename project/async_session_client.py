@@ -0,0 +1,100 @@
+import asyncio
+import json
+from typing import Any
+
+import httpx
+from authlib.integrations.httpx_client import AsyncOAuth2Client
+
+from project import logger
+from project.metrics import metrics
+from project.session_client import SessionClient
+
+
+class AsyncSessionClient(SessionClient):
+    """SessionClient on an httpx AsyncOAuth2Client.
+
+    The token is taken from the blocking token_client, which refreshes it
+    and persists it to Redis for both clients in the default executor.
+    Create it inside the running event loop and close() it there.
+    """
+
+    def __init__(self, token_client: SessionClient):
+        self.token_client = token_client
+        super().__init__()
+        self.token_lock = asyncio.Lock()
+
+    def _load_token(self) -> dict:
+        # A copy, an expired token is refreshed before the first request
+        return dict(self.token_client.session.token)
+
+    def _create_session(self) -> AsyncOAuth2Client:
+        # Without token endpoint the session does not refresh on its own
+        return AsyncOAuth2Client(
+            self.client_id,
+            self.client_secret,
+            scope=self.scope,
+            token=self.token,
+            token_endpoint_auth_method="client_secret_post",
+        )
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def get(self, url: str) -> httpx.Response:
+        url = self.complete_url(url)
+        logger.debug(f"GET {url}")
+        response = await self._send("GET", url)
+        self.status_code_or_raise(response, 200)
+        return response
+
+    async def post(self, url: str, data: Any) -> httpx.Response:
+        url = self.complete_url(url)
+        logger.debug(f"POST {url}\n{json.dumps(data)}")
+        response = await self._send("POST", url, json=data)
+        self.status_code_or_raise(response, 201)
+        return response
+
+    async def put(self, url: str, data: Any) -> httpx.Response:
+        url = self.complete_url(url)
+        logger.debug(f"PUT {url}\n{json.dumps(data)}")
+        response = await self._send("PUT", url, json=data)
+        self.status_code_or_raise(response, 204)
+        return response
+
+    async def patch(self, url: str, data: Any) -> httpx.Response:
+        url = self.complete_url(url)
+        logger.debug(f"PATCH {url}\n{json.dumps(data)}")
+        response = await self._send("PATCH", url, json=data)
+        self.status_code_or_raise(response, 204)
+        return response
+
+    async def delete(self, url: str) -> httpx.Response:
+        url = self.complete_url(url)
+        logger.debug(f"DELETE {url}")
+        response = await self._send("DELETE", url)
+        self.status_code_or_raise(response, 204)
+        return response
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        with metrics.timer("api_request", method=method):
+            response = await self.limiter.request_async(
+                lambda: self._request(method, url, **kwargs)
+            )
+
+        metrics.increment("api_requests", method=method, status=response.status_code)
+        return response
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        # Checked right before sending, because the limiter may have waited
+        await self._ensure_active_token()
+        return await self.session.request(method, url, **kwargs)
+
+    async def _ensure_active_token(self):
+        async with self.token_lock:
+            token = self.session.token
+
+            if token and token.is_expired():
+                loop = asyncio.get_running_loop()
+                self.session.token = await loop.run_in_executor(
+                    None, self.token_client.get_active_token
+                )
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from project.metrics import metrics
+
+BATCH_LINGER = 0.01
+
+ParsedPage = namedtuple("ParsedPage", ["item", "projection", "item_hash"])
+
+# Set up once per worker process by _init_worker
+_event_parser = None
+_event_mapper = None
+
+
+def _init_worker(parser: str, categories: dict):
+    global _event_parser, _event_mapper
+
+    from project.event_mapper import EventMapper
+    from project.page_parser import EventParser
+
+    _event_parser = EventParser(parser)
+    _event_mapper = EventMapper(categories)
+
+
+def _process_pages(pages: list) -> list:
+    # Returns the parsed page or the error with the seconds spent parsing
+    # and hashing for each page. Projections that fail are left to the
+    # importer, which builds them again and reports the error.
+    results = list()
+
+    for html in pages:
+        start = time.perf_counter()
+
+        try:
+            item = _event_parser.parse(html)
+        except Exception as e:
+            results.append((None, repr(e), 0, 0))
+            continue
+
+        parsed = time.perf_counter()
+        projection = None
+        item_hash = None
+
+        if item:
+            try:
+                projection = _event_mapper.build_projection(item)
+                item_hash = _event_mapper.hash_projection(projection)
+            except Exception:
+                projection = None
+
+        hashed = time.perf_counter()
+        page = ParsedPage(item, projection, item_hash)
+        results.append((page, None, parsed - start, hashed - parsed))
+
+    return results
+
+
+class PageProcessingError(Exception):
+    pass
+
+
+class PageProcessor:
+    """Parses event pages and hashes their projection in worker processes.
+
+    Pages are sent to the processes in batches of batch_size, or BATCH_LINGER
+    seconds after the first page of a batch was submitted. Use as context
+    manager.
+    """
+
+    def __init__(self, workers: int, batch_size: int, parser: str, categories: dict):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.parser = parser
+        self.categories = categories
+        self.lock = threading.Lock()
+        self.pending = list()
+        self.timer = None
+        self.executor = None
+
+    def __enter__(self):
+        # Imported here, because the pool is optional
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Spawned, because forking would copy the locks of running threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.parser, self.categories),
+        )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        self.executor.shutdown(wait=True)
+
+    def submit(self, html) -> Future:
+        future = Future()
+
+        with self.lock:
+            self.pending.append((html, future))
+
+            if len(self.pending) >= self.batch_size:
+                batch = self._take_batch()
+            else:
+                batch = None
+
+                if len(self.pending) == 1:
+                    self._start_timer()
+
+        if batch:
+            self._send(batch)
+
+        return future
+
+    def flush(self):
+        with self.lock:
+            batch = self._take_batch()
+
+        if batch:
+            self._send(batch)
+
+    def _start_timer(self):
+        self.timer = threading.Timer(BATCH_LINGER, self.flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _take_batch(self) -> list:
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        batch = self.pending
+        self.pending = list()
+        return batch
+
+    def _send(self, batch: list):
+        pages = [html for html, _ in batch]
+        futures = [future for _, future in batch]
+        metrics.increment("cpu_batches")
+        metrics.increment("cpu_pages", len(pages))
+
+        try:
+            batch_future = self.executor.submit(_process_pages, pages)
+        except Exception as e:
+            self._fail(futures, e)
+            return
+
+        batch_future.add_done_callback(
+            lambda batch_future: self._resolve(futures, batch_future)
+        )
+
+    def _resolve(self, futures: list, batch_future: Future):
+        try:
+            results = batch_future.result()
+        except Exception as e:
+            self._fail(futures, e)
+            return
+
+        for future, (page, error, parse_seconds, hash_seconds) in zip(futures, results):
+            if error:
+                future.set_exception(PageProcessingError(error))
+                continue
+
+            metrics.observe("parse", parse_seconds)
+
+            if page.item_hash:
+                metrics.observe("hash", hash_seconds)
+
+            future.set_result(page)
+
+    def _fail(self, futures: list, error: Exception):
+        for future in futures:
+            future.set_exception(error)
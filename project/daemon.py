@@ -0,0 +1,183 @@
+import datetime
+import json
+import os
+import random
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from project import berlin_tz, logger
+from project.api_client import ApiClient
+from project.harzinfo_loader import HarzinfoLoader
+from project.metrics import metrics
+
+
+class HealthRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        daemon = self.server.importer_daemon
+
+        if self.path == "/health":
+            healthy, stats = daemon.health()
+            self._send_json(200 if healthy else 503, stats)
+        elif self.path == "/stats":
+            self._send_json(200, daemon.report())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data, indent=2, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class Daemon:
+    """Runs an importer every DAEMON_INTERVAL seconds in one process.
+
+    The clients with their connection pools and OAuth token, the categories
+    and the place and organizer indexes are kept between runs and reloaded
+    every DAEMON_REFRESH_INTERVAL hours. Health and stats of the runs are
+    served on HEALTH_PORT.
+    """
+
+    def __init__(self, importer_class):
+        self.importer_class = importer_class
+        self.interval = float(os.getenv("DAEMON_INTERVAL", "900"))
+        self.jitter = float(os.getenv("DAEMON_JITTER", "60"))
+        self.refresh_interval = float(os.getenv("DAEMON_REFRESH_INTERVAL", "24"))
+        self.health_host = os.getenv("HEALTH_HOST", "127.0.0.1")
+        self.health_port = int(os.getenv("HEALTH_PORT", "8080"))
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.harzinfo_loader = HarzinfoLoader()
+        self.api_client = ApiClient()
+        self.categories = dict()
+        self.refreshed_at = time.monotonic()
+        self.started_at = datetime.datetime.now(tz=berlin_tz)
+        self.stats = {
+            "runs": 0,
+            "failed_runs": 0,
+            "running": False,
+            "last_start": None,
+            "last_finish": None,
+            "last_success": None,
+            "last_error": None,
+            "next_run": None,
+            "events": dict(),
+        }
+        self.last_report = None
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        server = self._start_health_server()
+
+        try:
+            while not self.stop_event.is_set():
+                start = time.monotonic()
+                self._run_once()
+                self._wait(start)
+        finally:
+            if server:
+                server.shutdown()
+
+        logger.info("Daemon stopped.")
+
+    def health(self) -> tuple:
+        # Healthy until a run failed or no run finished for two intervals
+        with self.lock:
+            stats = dict(self.stats)
+
+        max_age = datetime.timedelta(seconds=2 * self.interval + self.jitter)
+        last_success = stats["last_success"] or self.started_at
+        now = datetime.datetime.now(tz=berlin_tz)
+        healthy = stats["last_error"] is None and now - last_success <= max_age
+        return healthy, stats
+
+    def report(self) -> dict:
+        with self.lock:
+            return {"daemon": dict(self.stats), "last_run": self.last_report}
+
+    def _run_once(self):
+        self._refresh()
+        importer = self.importer_class(self.harzinfo_loader, self.api_client)
+        importer.categories = self.categories
+        self._update_stats(running=True, last_start=self._now())
+        error = None
+
+        try:
+            importer.run()
+        except Exception as e:
+            logger.error("Daemon run Exception", exc_info=True)
+            error = repr(e)
+
+        self.categories = importer.categories
+        events = {
+            result: getattr(importer, f"{result}_event_count")
+            for result in ["unchanged", "new", "updated", "deleted", "failed"]
+        }
+
+        with self.lock:
+            self.last_report = metrics.report()
+            self.stats["runs"] = self.stats["runs"] + 1
+            self.stats["running"] = False
+            self.stats["last_finish"] = self._now()
+            self.stats["last_error"] = error
+            self.stats["events"] = events
+
+            if error:
+                self.stats["failed_runs"] = self.stats["failed_runs"] + 1
+            else:
+                self.stats["last_success"] = self.stats["last_finish"]
+
+    def _refresh(self):
+        age = time.monotonic() - self.refreshed_at
+
+        if age < self.refresh_interval * 3600:
+            return
+
+        logger.info("Reloading categories and indexes.")
+        self.categories = dict()
+        self.api_client.indexes = dict()
+        self.refreshed_at = time.monotonic()
+
+    def _wait(self, start: float):
+        # The next run starts an interval after the start of the last one,
+        # shifted randomly so that several daemons do not run in lockstep.
+        delay = self.interval + random.uniform(-self.jitter, self.jitter)
+        timeout = max(0, start + delay - time.monotonic())
+        next_run = self._now() + datetime.timedelta(seconds=timeout)
+        self._update_stats(next_run=next_run)
+        logger.info(f"Next run at {next_run.isoformat()}.")
+        self.stop_event.wait(timeout)
+
+    def _stop(self, signum, frame):
+        logger.info("Stopping daemon after the current run..")
+        self.stop_event.set()
+
+    def _start_health_server(self) -> ThreadingHTTPServer:
+        if not self.health_port:
+            return None
+
+        server = ThreadingHTTPServer(
+            (self.health_host, self.health_port), HealthRequestHandler
+        )
+        server.daemon_threads = True
+        server.importer_daemon = self
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        logger.info(f"Serving health on {self.health_host}:{self.health_port}.")
+        return server
+
+    def _update_stats(self, **stats):
+        with self.lock:
+            self.stats.update(stats)
+
+    def _now(self) -> datetime.datetime:
+        return datetime.datetime.now(tz=berlin_tz)
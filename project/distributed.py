@@ -0,0 +1,408 @@
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+from project import logger, r
+from project.api_client import ApiClient
+from project.harzinfo_loader import HarzinfoLoader
+from project.importer import Importer
+from project.metrics import metrics
+
+RESULTS = ["unchanged", "new", "updated", "failed"]
+# Reported by workers next to the results
+COUNTS = RESULTS + ["unknown_entities"]
+
+
+def _queue_key(run_id: str, name: str) -> str:
+    return f"queue:{run_id}:{name}"
+
+
+def _delete_queue(run_id: str):
+    worker_ids = r.smembers(_queue_key(run_id, "workers"))
+    r.delete(
+        *[
+            _queue_key(run_id, name)
+            for name in [
+                "run",
+                "urls",
+                "uids",
+                "urls_in_run",
+                "place_keys",
+                "organizer_keys",
+                "workers",
+            ]
+        ],
+        *[_queue_key(run_id, f"processing:{worker_id}") for worker_id in worker_ids],
+        *[_queue_key(run_id, f"lease:{worker_id}") for worker_id in worker_ids],
+        *[_queue_key(run_id, f"claims:{worker_id}") for worker_id in worker_ids],
+    )
+
+
+def _requeue_leased_urls(run_id: str, worker_id: str) -> int:
+    # Moves the URLs a worker took but did not acknowledge back to the queue.
+    # Their UIDs are released first, so that the next worker may claim them.
+    claims_key = _queue_key(run_id, f"claims:{worker_id}")
+    claimed_uids = r.smembers(claims_key)
+
+    if claimed_uids:
+        r.srem(_queue_key(run_id, "uids"), *claimed_uids)
+
+    r.delete(claims_key)
+    processing_key = _queue_key(run_id, f"processing:{worker_id}")
+    requeued = 0
+
+    while r.rpoplpush(processing_key, _queue_key(run_id, "urls")):
+        requeued = requeued + 1
+
+    r.srem(_queue_key(run_id, "workers"), worker_id)
+    r.delete(_queue_key(run_id, f"lease:{worker_id}"))
+    return requeued
+
+
+class Coordinator(Importer):
+    """Pushes the sitemap into a Redis queue and purges once workers are done.
+
+    The run is described by the queue:<run_id>:run hash. Workers report their
+    counters and the number of processed URLs there and add the UIDs, URLs,
+    places and organizers they saw to the sets of the run. The purge only
+    starts when every pushed URL was reported.
+
+    Workers move the URLs they take into a processing list of their own and
+    remove them once they are acknowledged. The URLs of workers whose lease
+    expired are put back into the queue.
+    """
+
+    def __init__(
+        self, harzinfo_loader: HarzinfoLoader = None, api_client: ApiClient = None
+    ):
+        super().__init__(harzinfo_loader, api_client)
+        self.run_id = uuid.uuid4().hex
+        self.push_batch_size = int(os.getenv("QUEUE_PUSH_BATCH_SIZE", "500"))
+        self.poll_interval = float(os.getenv("QUEUE_POLL_INTERVAL", "1"))
+        self.queue_timeout = float(os.getenv("QUEUE_TIMEOUT", "900"))
+
+    def _resume_from_checkpoint(self):
+        # The queue keeps the progress of a distributed run
+        pass
+
+    def _load_categories(self):
+        pass
+
+    def _load_indexes(self):
+        pass
+
+    def _import_events(self, sitememap_urls):
+        self._publish_run()
+        pushed = self._push_urls(sitememap_urls)
+        self._wait_for_workers(pushed)
+        self._collect_results()
+
+    def _publish_run(self):
+        previous_run_id = r.get("queue:current")
+
+        if previous_run_id:
+            logger.info(f"Discarding unfinished distributed run {previous_run_id}.")
+            _delete_queue(previous_run_id)
+
+        run = {"start_time": self.start_time.isoformat()}
+
+        if self.last_run:
+            run["last_run"] = self.last_run.isoformat()
+
+        r.hset(self._key("run"), mapping=run)
+        r.set("queue:current", self.run_id)
+
+    def _push_urls(self, sitememap_urls) -> int:
+        pushed = 0
+        batch = list()
+
+        for url, lastmod in sitememap_urls:
+            batch.append(json.dumps([url, lastmod]))
+
+            if len(batch) >= self.push_batch_size:
+                r.lpush(self._key("urls"), *batch)
+                pushed = pushed + len(batch)
+                batch = list()
+
+        # Workers take URLs from the tail, so they are imported in order
+        if batch:
+            r.lpush(self._key("urls"), *batch)
+            pushed = pushed + len(batch)
+
+        # Workers stop waiting for URLs once the run is marked as pushed
+        r.hset(self._key("run"), mapping={"pushed": pushed, "done": 1})
+        logger.info(f"Pushed {pushed} URLs to run {self.run_id}.")
+        return pushed
+
+    def _wait_for_workers(self, pushed: int):
+        # Gives up once no URL was processed for QUEUE_TIMEOUT seconds
+        last_processed = 0
+        deadline = time.monotonic() + self.queue_timeout
+
+        with metrics.timer("stage", stage="wait_for_workers"):
+            while True:
+                processed = int(r.hget(self._key("run"), "processed") or 0)
+
+                if processed >= pushed:
+                    return
+
+                if processed > last_processed:
+                    last_processed = processed
+                    deadline = time.monotonic() + self.queue_timeout
+                elif time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"Workers processed {processed} of {pushed} URLs of run {self.run_id}"
+                    )
+
+                self._requeue_stale_leases()
+                time.sleep(self.poll_interval)
+
+    def _requeue_stale_leases(self):
+        for worker_id in r.smembers(self._key("workers")):
+            if r.exists(self._key(f"lease:{worker_id}")):
+                continue
+
+            requeued = _requeue_leased_urls(self.run_id, worker_id)
+
+            if requeued:
+                logger.warning(
+                    f"Lease of worker {worker_id} expired. Requeued {requeued} URLs."
+                )
+                metrics.increment("queue_requeued_urls", requeued)
+
+    def _collect_results(self):
+        run = r.hgetall(self._key("run"))
+
+        for result in COUNTS:
+            setattr(self, f"{result}_event_count", int(run.get(result, 0)))
+
+        self.uids_in_run = r.smembers(self._key("uids"))
+        self.urls_in_run = r.smembers(self._key("urls_in_run"))
+        self.place_keys_in_run = r.smembers(self._key("place_keys"))
+        self.organizer_keys_in_run = r.smembers(self._key("organizer_keys"))
+
+        # Workers inserted events, places and organizers meanwhile
+        self.stored_event_mapping = self._load_hash("event_mapping")
+        self.stored_url_mapping = self._load_hash("url_mapping")
+        self.stored_url_validators = self._load_hash("url_validators")
+        self.stored_place_mapping = self._load_hash("place_mapping")
+        self.stored_organizer_mapping = self._load_hash("organizer_mapping")
+
+    def _finish_run(self):
+        super()._finish_run()
+        self.redis_writer.flush()
+        _delete_queue(self.run_id)
+        r.delete("queue:current")
+
+    def _key(self, name: str) -> str:
+        return _queue_key(self.run_id, name)
+
+
+class Worker(Importer):
+    """Imports the URLs of one distributed run from the Redis queue."""
+
+    def __init__(self, run_id: str):
+        super().__init__()
+        self.run_id = run_id
+        self.worker_id = uuid.uuid4().hex
+        self.poll_interval = float(os.getenv("QUEUE_POLL_INTERVAL", "1"))
+        self.pop_batch_size = int(os.getenv("QUEUE_POP_BATCH_SIZE", "20"))
+        self.lease_timeout = int(os.getenv("QUEUE_LEASE_TIMEOUT", "60"))
+        self.leased_items = dict()
+        self.heartbeat_stop = threading.Event()
+        self.reported_counts = {result: 0 for result in COUNTS}
+        self.reported_place_keys = set()
+        self.reported_organizer_keys = set()
+
+    def run(self):
+        self._renew_lease()
+        r.sadd(self._key("workers"), self.worker_id)
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+
+        try:
+            with self.redis_writer:
+                self._start_run()
+                self._load_categories()
+                self._load_indexes()
+
+                self._load_stored_state()
+
+                # URLs of other workers may be requeued until the run is done
+                with metrics.timer("stage", stage="import"):
+                    while not self._is_run_finished():
+                        self._import_events(self._iterate_queue())
+
+                logger.info(
+                    f"Worker: {self.unchanged_event_count} unchanged, {self.new_event_count} new, {self.updated_event_count} updated, {self.failed_event_count} failed"
+                )
+        finally:
+            self.heartbeat_stop.set()
+            heartbeat.join()
+            # Whatever was not acknowledged is left to the other workers
+            _requeue_leased_urls(self.run_id, self.worker_id)
+            self._write_run_report()
+
+    def _heartbeat(self):
+        while not self.heartbeat_stop.wait(self.lease_timeout / 3):
+            try:
+                self._renew_lease()
+            except Exception:
+                logger.error("Lease Exception", exc_info=True)
+
+    def _renew_lease(self):
+        r.set(self._key(f"lease:{self.worker_id}"), 1, ex=self.lease_timeout)
+
+    def _start_run(self):
+        run = r.hgetall(self._key("run"))
+        self.start_time = datetime.datetime.fromisoformat(run["start_time"])
+
+        if "last_run" in run:
+            self.last_run = datetime.datetime.fromisoformat(run["last_run"])
+
+    def _iterate_queue(self):
+        while True:
+            batch = self._pop_batch()
+
+            if batch:
+                items = [json.loads(item) for item in batch]
+
+                for item, (url, _) in zip(batch, items):
+                    self.leased_items.setdefault(url, list()).append(item)
+
+                yield items
+                continue
+
+            if r.hget(self._key("run"), "done") or self._is_discarded():
+                return
+
+    def _is_run_finished(self) -> bool:
+        done, pushed, processed = r.hmget(
+            self._key("run"), "done", "pushed", "processed"
+        )
+        finished = done and int(processed or 0) >= int(pushed or 0)
+        return finished or self._is_discarded()
+
+    def _is_discarded(self) -> bool:
+        if r.get("queue:current") == self.run_id:
+            return False
+
+        logger.info(f"Run {self.run_id} was discarded.")
+        return True
+
+    def _pop_batch(self) -> list:
+        processing_key = self._key(f"processing:{self.worker_id}")
+        item = r.brpoplpush(
+            self._key("urls"), processing_key, timeout=max(1, int(self.poll_interval))
+        )
+
+        if not item:
+            return None
+
+        # Take a few more URLs if there are some, but never wait for them
+        pipeline = r.pipeline(transaction=False)
+
+        for _ in range(self.pop_batch_size - 1):
+            pipeline.rpoplpush(self._key("urls"), processing_key)
+
+        return [item] + [url for url in pipeline.execute() if url]
+
+    def _prefetch_stored_state(self, batches):
+        # The queue is read in small batches, so that other workers get URLs
+        # as well. The state of each batch is prefetched at once.
+        for batch in batches:
+            self._prefetch_chunk(batch)
+            yield from batch
+
+    def _claim_uid(self, uid: str) -> bool:
+        # The set of the run is shared by all workers, SADD tells who was first.
+        # Claims are released again if the worker dies before acknowledging.
+        self.uids_in_run.add(uid)
+
+        if r.sadd(self._key("uids"), uid) == 0:
+            return False
+
+        r.sadd(self._key(f"claims:{self.worker_id}"), uid)
+        return True
+
+    def _complete_event(self, url: str, uid: str = None):
+        self._update_sitemap_snapshot(url)
+        self._acknowledge(url, uid)
+
+    def _fail_event(self, url: str):
+        super()._fail_event(url)
+        self._acknowledge(url, self.stored_url_mapping.get(url))
+
+    def _acknowledge(self, url: str, uid: str = None):
+        # Counters and keys are buffered in the same writer as the mappings of
+        # the event, so they reach Redis after them.
+        for result in COUNTS:
+            count = getattr(self, f"{result}_event_count")
+            delta = count - self.reported_counts[result]
+
+            if delta:
+                self.redis_writer.hincrby(self._key("run"), result, delta)
+                self.reported_counts[result] = count
+
+        self.reported_place_keys = self._report_keys(
+            "place_keys", self.place_keys_in_run, self.reported_place_keys
+        )
+        self.reported_organizer_keys = self._report_keys(
+            "organizer_keys", self.organizer_keys_in_run, self.reported_organizer_keys
+        )
+        self.redis_writer.sadd(self._key("urls_in_run"), url)
+        self.redis_writer.hincrby(self._key("run"), "processed", 1)
+
+        if uid:
+            self.redis_writer.srem(self._key(f"claims:{self.worker_id}"), uid)
+
+        leased_items = self.leased_items.get(url)
+
+        if leased_items:
+            self.redis_writer.lrem(
+                self._key(f"processing:{self.worker_id}"), leased_items.pop()
+            )
+
+            if not leased_items:
+                del self.leased_items[url]
+
+        # A crashed worker may only lose URLs that are still in its lease
+        self.redis_writer.flush()
+
+    def _report_keys(self, name: str, keys: set, reported: set) -> set:
+        # Keys are only ever added, so an unchanged size means nothing is new
+        if len(keys) == len(reported):
+            return reported
+
+        keys = keys.copy()
+        self.redis_writer.sadd(self._key(name), *(keys - reported))
+        return keys
+
+    def _key(self, name: str) -> str:
+        return _queue_key(self.run_id, name)
+
+
+def run_worker():
+    poll_interval = float(os.getenv("QUEUE_POLL_INTERVAL", "1"))
+    finished_run_id = None
+
+    while True:
+        run_id = r.get("queue:current")
+
+        if not run_id or run_id == finished_run_id:
+            time.sleep(poll_interval)
+            continue
+
+        logger.info(f"Working on run {run_id}.")
+
+        try:
+            Worker(run_id).run()
+        except Exception:
+            logger.error(f"Worker Exception {run_id}", exc_info=True)
+            time.sleep(poll_interval)
+            continue
+
+        finished_run_id = run_id
@@ -0,0 +1,201 @@
+from project.fingerprint import Fingerprint
+
+
+class EventMapper:
+    """Maps the ld+json of an event to what is sent to the API and hashes it.
+
+    Holds no connections, so that it can be used in worker processes.
+    """
+
+    def __init__(self, categories: dict = None):
+        self.categories = categories or dict()
+        self.fingerprint = Fingerprint()
+        self.event_type_mapping = {
+            "ChildrensEvent": "Family",
+            "ComedyEvent": "Comedy",
+            "DanceEvent": "Dance",
+            "EducationEvent": "Lecture",
+            "ExhibitionEvent": "Exhibition",
+            "Festival": "Festival",
+            "FoodEvent": "Dining",
+            "LiteraryEvent": "Book",
+            "MusicEvent": "Music",
+            "SportsEvent": "Sports",
+            "TheaterEvent": "Theater",
+        }
+        self.event_status_mapping = {
+            "EventScheduled": "scheduled",
+            "EventCancelled": "cancelled",
+            "EventMovedOnline": "movedOnline",
+            "EventPostponed": "postponed",
+            "EventRescheduled": "rescheduled",
+        }
+
+    def build_projection(self, item: dict) -> dict:
+        event = dict()
+        event["external_link"] = item["url"]
+        event["name"] = item["name"]
+        event["start"] = item["startDate"]
+
+        if "description" in item:
+            event["description"] = item["description"]
+
+        self._import_event_photo(event, item)
+        self._import_event_status(event, item)
+        self._add_categories(event, item)
+        self._add_tags(event, item)
+
+        return {
+            "event": event,
+            "organizer": self._build_organizer(item),
+            "place": self._build_place(item),
+        }
+
+    def _import_event_photo(self, event, item) -> str:
+        if "image" not in item:
+            return
+
+        image = item["image"]
+
+        if isinstance(image, list) and len(image) == 0:
+            return
+
+        first_image = image[0] if isinstance(image, list) else image
+
+        if not isinstance(first_image, dict):
+            return
+
+        if "url" not in first_image:
+            return
+
+        photo = dict()
+        photo["image_url"] = first_image["url"]
+
+        if "contributor" in first_image:
+            photo["copyright_text"] = first_image["contributor"]
+
+        event["photo"] = photo
+
+    def _import_event_status(self, event, item: dict) -> str:
+        if "eventStatus" in item:
+            eventStatus = item["eventStatus"]
+
+            if eventStatus in self.event_status_mapping:
+                event["status"] = self.event_status_mapping[eventStatus]
+                return
+
+            if eventStatus == "ausgebucht":
+                event["booked_up"] = True
+
+        event["status"] = "scheduled"
+
+    def _build_organizer(self, item: dict) -> dict:
+        organizer_item = item["author"]
+
+        if len(item["organizer"]) > 0 and item["organizer"][0]:
+            organizer_item = item["organizer"][0]
+
+        organizer_name = organizer_item["name"]
+
+        organizer = dict()
+        organizer["name"] = organizer_name
+
+        if "url" in organizer_item and self.is_url(organizer_item["url"]):
+            organizer["url"] = organizer_item["url"]
+
+        if "email" in organizer_item:
+            organizer["email"] = organizer_item["email"]
+
+        if "telephone" in organizer_item:
+            organizer["phone"] = organizer_item["telephone"]
+
+        if "faxNumber" in organizer_item:
+            organizer["fax"] = organizer_item["faxNumber"]
+
+        if "address" in organizer_item:
+            organizer["location"] = self._import_location(organizer_item["address"])
+
+        return organizer
+
+    def _build_place(self, item: dict) -> dict:
+        place_item = item["location"][0]
+        place_name = place_item["name"]
+
+        place = dict()
+        place["name"] = place_name
+        location = dict()
+
+        if "address" in place_item:
+            location = self._import_location(place_item["address"])
+
+        if "coordinate" in item:
+            lat_str, lon_str = item["coordinate"].split(",")
+            latitude = float(lat_str)
+            longitude = float(lon_str)
+            if latitude != 0 and longitude != 0:
+                location["latitude"] = latitude
+                location["longitude"] = longitude
+
+        place["location"] = location
+        return place
+
+    def _import_location(self, address: dict) -> dict:
+        location = dict()
+        if "streetAddress" in address:
+            location["street"] = address["streetAddress"]
+
+        if "postalCode" in address:
+            location["postalCode"] = address["postalCode"]
+
+        if "addressLocality" in address:
+            location["city"] = address["addressLocality"]
+
+        if "addressCountry" in address:
+            location["country"] = address["addressCountry"]
+        return location
+
+    def _add_categories(self, event: dict, item: dict):
+        if "@type" not in item:
+            return
+
+        event_categories = list()
+
+        for item_type in item["@type"]:
+            if item_type in self.event_type_mapping:
+                category_name = self.event_type_mapping[item_type]
+                if category_name in self.categories:
+                    category = self.categories[category_name]
+                    event_categories.append(category)
+
+        if len(event_categories) > 0:
+            event["categories"] = event_categories
+
+    def _add_tags(self, event: dict, item: dict):
+        if "keywords" not in item:
+            return
+
+        tags = list()
+
+        for keyword in item["keywords"].split(","):
+            keyword = keyword.strip()
+            if not keyword[0].islower():
+                tags.append(keyword)
+
+        if len(tags) > 0:
+            event["tags"] = ",".join(tags)
+
+    def is_url(self, url: str) -> bool:
+        # validators takes long to import and is only needed for new pages
+        import validators
+
+        return validators.url(url)
+
+    def hash_projection(self, projection: dict) -> str:
+        event = projection["event"]
+
+        # The order of keywords does not matter
+        if "tags" in event:
+            tags = ",".join(sorted(event["tags"].split(",")))
+            projection = dict(projection, event=dict(event, tags=tags))
+
+        return self.fingerprint.hash(projection)
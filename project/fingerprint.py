@@ -0,0 +1,62 @@
+import base64
+import hashlib
+import json
+import os
+import re
+
+
+def _md5(item: dict) -> str:
+    item_str = json.dumps(item, sort_keys=True, ensure_ascii=True)
+    return hashlib.md5(item_str.encode("utf-8")).hexdigest()
+
+
+def _blake2b(item: dict) -> str:
+    item_str = json.dumps(
+        item, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    digest = hashlib.blake2b(item_str.encode("utf-8"), digest_size=16).digest()
+    return "b2:" + base64.b64encode(digest).decode("ascii").rstrip("=")
+
+
+SCHEMES = {"md5": _md5, "blake2b": _blake2b}
+
+
+class Fingerprint:
+    """Content hashes of events, places and organizers.
+
+    HASH_SCHEME selects how new hashes are computed: blake2b stores a 16 byte
+    digest of a compact JSON encoding as "b2:" and 22 base64 characters, md5
+    the 32 hex characters of earlier versions. Stored hashes of the other
+    scheme are still recognized, so that switching does not update every
+    event again.
+    """
+
+    def __init__(self):
+        self.scheme = os.getenv("HASH_SCHEME", "blake2b").lower()
+        self.hash_item = SCHEMES[self.scheme]
+
+    def hash(self, item: dict) -> str:
+        return self.hash_item(item)
+
+    def matches(self, item: dict, item_hash: str, stored_hash: str) -> bool:
+        if not stored_hash:
+            return False
+
+        if item_hash == stored_hash:
+            return True
+
+        stored_scheme = self.scheme_of(stored_hash)
+
+        if stored_scheme and stored_scheme != self.scheme:
+            return SCHEMES[stored_scheme](item) == stored_hash
+
+        return False
+
+    def scheme_of(self, stored_hash: str) -> str:
+        if stored_hash.startswith("b2:"):
+            return "blake2b"
+
+        if re.match(r"^[0-9a-f]{32}$", stored_hash):
+            return "md5"
+
+        return None
@@ -1,21 +1,120 @@
-import json
+import io
 import os
-from urllib import request
+import shutil
+import tempfile
+from xml.etree import ElementTree
 
-from bs4 import BeautifulSoup
-from werkzeug.utils import secure_filename
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from project.metrics import metrics
+from project.page_cache import CachedPage, PageCache, PageNotCached
+from project.page_parser import EventParser
+from project.rate_limiter import limiters
+
+# Larger sitemaps are buffered on disk instead of in memory
+SITEMAP_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class PageNotModified(Exception):
+    pass
 
 
 class HarzinfoLoader:
     def __init__(self):
-        self.use_tmp = os.getenv("USE_TMP", "False").lower() in ["true", "1"]
-        self.base_url = "https://www.harzinfo.de"
+        self.conditional_get = os.getenv("CONDITIONAL_GET", "True").lower() in [
+            "true",
+            "1",
+        ]
+        self.parser = os.getenv("HARZINFO_PARSER", "fast").lower()
+        self.event_parser = EventParser(self.parser)
+        self.base_url = os.getenv("HARZINFO_URL", "https://www.harzinfo.de")
+        self.timeout = float(os.getenv("HARZINFO_TIMEOUT", "30"))
+        self.session = self._create_session()
+        self.page_cache = PageCache() if os.getenv("PAGE_CACHE_PATH") else None
+        self.limiter = limiters.get(
+            self.base_url, "HARZINFO", int(os.getenv("HARZINFO_POOL_SIZE", "10"))
+        )
+
+    def _create_session(self) -> requests.Session:
+        pool_size = int(os.getenv("HARZINFO_POOL_SIZE", "10"))
+        retry = Retry(
+            total=int(os.getenv("HARZINFO_RETRIES", "3")),
+            backoff_factor=float(os.getenv("HARZINFO_BACKOFF", "0.5")),
+            status_forcelist=[500, 502, 504],
+            allowed_methods=["GET"],
+            # 429 and 503 are retried by the rate limiter
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
-    def load_sitemap(self):
-        xml = self._load_data(
+    def connection_stats(self) -> dict:
+        connections = 0
+        requests_served = 0
+
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                connections = connections + pool.num_connections
+                requests_served = requests_served + pool.num_requests
+
+        return {"connections": connections, "requests": requests_served}
+
+    def load_sitemap(self, validators: dict = None):
+        url = (
             self.base_url
             + "/sitemap.xml?sitemap=ndsdestinationdataevent&cHash=e286f0aef1548b7c25ffdcf9a075ca47"
         )
+
+        if self.parser == "bs4":
+            xml, validators = self._load_data(url, validators)
+            return self._parse_sitemap_with_bs4(xml), validators
+
+        file, validators = self._download_data(url, validators)
+        return self._iterate_sitemap(file), validators
+
+    def _iterate_sitemap(self, file):
+        # Yields while parsing, so the import starts with the first URLs.
+        # Duplicate locs are skipped, the first one wins.
+        seen_locs = set()
+        root = None
+        loc = None
+        lastmod = None
+
+        try:
+            for event, elem in ElementTree.iterparse(file, events=("start", "end")):
+                if root is None:
+                    root = elem
+
+                if event == "start":
+                    continue
+
+                tag = elem.tag.rsplit("}", 1)[-1]
+
+                if tag == "loc":
+                    loc = (elem.text or "").strip()
+                elif tag == "lastmod":
+                    lastmod = (elem.text or "").strip()
+                elif tag == "url":
+                    if loc and loc not in seen_locs:
+                        seen_locs.add(loc)
+                        yield loc, lastmod
+
+                    loc = None
+                    lastmod = None
+                    root.clear()
+        finally:
+            file.close()
+
+    def _parse_sitemap_with_bs4(self, xml):
+        from bs4 import BeautifulSoup
+
         xmlDict = {}
         soup = BeautifulSoup(xml, features="html.parser")
         url_tags = soup.find_all("url")
@@ -23,68 +122,140 @@ class HarzinfoLoader:
         for url_tag in url_tags:
             xmlDict[url_tag.findNext("loc").text] = url_tag.findNext("lastmod").text
 
-        return xmlDict
+        return iter(xmlDict.items())
 
     def load_event(self, absolute_url: str):
-        html = self._load_data(absolute_url)
-        soup = BeautifulSoup(html, features="html.parser")
-        ld_json_string = soup.find("script", {"type": "application/ld+json"}).string
-        ld_json_array = json.loads(ld_json_string)
-
-        if not ld_json_array:
-            return None
-
-        if len(ld_json_array) == 0:
-            return None
-
-        ld_json = ld_json_array[0]
-        ld_json = self._strip_ld_json(ld_json)
-
-        if "description" in ld_json:
-            desc_soup = BeautifulSoup(ld_json["description"], features="html.parser")
-            for br in desc_soup.find_all("br"):
-                br.replace_with("\n" + br.text)
-            ld_json["description"] = desc_soup.text
-
-        coordinate_div = soup.find("div", attrs={"data-position": True})
-        if coordinate_div:
-            ld_json["coordinate"] = coordinate_div["data-position"]
-
-        return ld_json
-
-    def _strip_ld_json(self, value: any) -> any:
-        if isinstance(value, str):
-            return value.strip()
-
-        if isinstance(value, dict):
-            result = dict()
-            for k, v in value.items():
-                result[k] = self._strip_ld_json(v)
-            return result
-
-        if isinstance(value, list):
-            result = list()
-            for elem in value:
-                result.append(self._strip_ld_json(elem))
-            return result
-
-        return value
-
-    def _load_data(self, absolute_url: str):
-        if self.use_tmp:
-            filename = f"tmp/{secure_filename(absolute_url)}.txt"
-
-            if not os.path.exists(filename):
-                response = self._load_data_from_url(absolute_url)
-                with open(filename, "wb") as text_file:
-                    text_file.write(response.read())
-
-            with open(filename) as data_file:
-                return data_file.read()
-        else:
-            response = self._load_data_from_url(absolute_url)
-            return response.read()
-
-    def _load_data_from_url(self, absolute_url: str):
-        req = request.Request(absolute_url)
-        return request.urlopen(req)
+        html, _ = self.fetch_event(absolute_url)
+        return self.parse_event(html)
+
+    def fetch_event(self, absolute_url: str, validators: dict = None):
+        return self._load_data(absolute_url, validators)
+
+    def parse_event(self, html):
+        with metrics.timer("parse"):
+            return self.event_parser.parse(html)
+
+    def _load_data(self, absolute_url: str, validators: dict = None):
+        if not self.conditional_get:
+            validators = None
+
+        if self.page_cache:
+            page = self.page_cache.get(absolute_url)
+
+            if not self._is_cache_hit(absolute_url, page):
+                page = self._refresh_cached_page(absolute_url, page)
+
+            return self._read_cached_page(page, validators)
+
+        return self._load_data_from_url(absolute_url, validators)
+
+    def _is_cache_hit(self, absolute_url: str, page: CachedPage) -> bool:
+        # Pages are only fetched when the sitemap or its lastmod changed, so
+        # outside of replay mode a cached page is always revalidated
+        if not self.page_cache.replay:
+            return False
+
+        if page is None:
+            raise PageNotCached(absolute_url)
+
+        metrics.increment("page_cache", result="hit")
+        return True
+
+    def _refresh_cached_page(self, absolute_url: str, page: CachedPage) -> CachedPage:
+        try:
+            data, validators = self._load_data_from_url(
+                absolute_url, page.validators if page else None
+            )
+        except PageNotModified:
+            metrics.increment("page_cache", result="revalidated")
+            return self.page_cache.touch(page)
+
+        metrics.increment("page_cache", result="miss")
+        return self.page_cache.put(absolute_url, data, validators)
+
+    def _read_cached_page(self, page: CachedPage, validators: dict = None):
+        # The caller already has this version of the page
+        if validators and validators == page.validators:
+            raise PageNotModified(page.url)
+
+        return self.page_cache.read(page), page.validators
+
+    def _download_data(self, absolute_url: str, validators: dict = None):
+        # The body is read completely before it is parsed, so the connection
+        # is not held open while the events are imported
+        if self.page_cache:
+            data, validators = self._load_data(absolute_url, validators)
+            return io.BytesIO(data), validators
+
+        if not self.conditional_get:
+            validators = None
+
+        response = self._request(absolute_url, validators, stream=True)
+        file = tempfile.SpooledTemporaryFile(max_size=SITEMAP_SPOOL_SIZE)
+
+        try:
+            with response:
+                response.raw.decode_content = True
+                shutil.copyfileobj(response.raw, file)
+        except Exception:
+            file.close()
+            raise
+
+        metrics.increment("harzinfo_bytes_downloaded", file.tell())
+        file.seek(0)
+        return file, self._get_validators(response)
+
+    def _load_data_from_url(self, absolute_url: str, validators: dict = None):
+        response = self._request(absolute_url, validators)
+        metrics.increment("harzinfo_bytes_downloaded", len(response.content))
+        return response.content, self._get_validators(response)
+
+    def _request(
+        self, absolute_url: str, validators: dict = None, stream: bool = False
+    ) -> requests.Response:
+        headers = self._get_request_headers(validators)
+
+        with metrics.timer("fetch"):
+            response = self.limiter.request(
+                lambda: self.session.get(
+                    absolute_url, headers=headers, timeout=self.timeout, stream=stream
+                )
+            )
+
+        metrics.increment(
+            "harzinfo_requests", method="GET", status=response.status_code
+        )
+
+        retries = response.raw.retries
+        if retries and retries.history:
+            metrics.increment("harzinfo_retries", len(retries.history))
+
+        if response.status_code == 304:
+            response.close()
+            raise PageNotModified(absolute_url)
+
+        response.raise_for_status()
+        return response
+
+    def _get_request_headers(self, validators: dict) -> dict:
+        headers = dict()
+
+        if validators:
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+
+            if "last_modified" in validators:
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        return headers
+
+    def _get_validators(self, response: requests.Response) -> dict:
+        validators = dict()
+
+        if "ETag" in response.headers:
+            validators["etag"] = response.headers["ETag"]
+
+        if "Last-Modified" in response.headers:
+            validators["last_modified"] = response.headers["Last-Modified"]
+
+        return validators
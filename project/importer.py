@@ -1,402 +1,1060 @@
+import contextlib
 import datetime
-import hashlib
+import functools
 import json
+import os
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 
-import validators
-
-from project import logger, now, r
+from project import berlin_tz, logger, r
 from project.api_client import ApiClient
-from project.harzinfo_loader import HarzinfoLoader
+from project.cpu_pool import PageProcessor, ParsedPage
+from project.event_mapper import EventMapper
+from project.fingerprint import Fingerprint
+from project.harzinfo_loader import HarzinfoLoader, PageNotModified
+from project.metrics import metrics
+from project.rate_limiter import limiters
+from project.redis_writer import RedisWriter
+from project.state_store import load_hash
+
+# Values of url_mapping for pages without an event
+NO_DATA = "nodata"
+INVALID_URL = "invalidurl"
+NO_EVENT_MARKERS = (NO_DATA, INVALID_URL)
 
 
 class Importer:
-    def __init__(self):
-        self.harzinfo_loader = HarzinfoLoader()
-        self.api_client = ApiClient()
+    def __init__(
+        self, harzinfo_loader: HarzinfoLoader = None, api_client: ApiClient = None
+    ):
+        metrics.reset()
+        self.harzinfo_loader = harzinfo_loader or HarzinfoLoader()
+        self.api_client = api_client or ApiClient()
+        self.redis_writer = RedisWriter()
+        self.fingerprint = Fingerprint()
+        self.event_mapper = EventMapper()
         self.start_time = None
         self.last_run = None
-        self.stored_event_mapping = r.hgetall("event_mapping")
-        self.stored_event_hashes = r.hgetall("event_hashes")
-        self.stored_url_mapping = r.hgetall("url_mapping")
-        self.stored_place_mapping = r.hgetall("place_mapping")
-        self.stored_place_hashes = r.hgetall("place_hashes")
-        self.stored_organizer_mapping = r.hgetall("organizer_mapping")
-        self.stored_organizer_hashes = r.hgetall("organizer_hashes")
+        self.fetch_workers = int(os.getenv("FETCH_WORKERS", "8"))
+        self.api_workers = int(os.getenv("API_WORKERS", "4"))
+        self.cpu_workers = int(os.getenv("CPU_WORKERS", "0"))
+        self.cpu_batch_size = int(os.getenv("CPU_BATCH_SIZE", "16"))
+        self.page_processor = None
+        self.preload_index = os.getenv("PRELOAD_INDEX", "False").lower() in [
+            "true",
+            "1",
+        ]
+        self.purge_workers = int(os.getenv("PURGE_WORKERS", "4"))
+        self.purge_dry_run = os.getenv("PURGE_DRY_RUN", "False").lower() in [
+            "true",
+            "1",
+        ]
+        self.checkpoint_interval = int(os.getenv("CHECKPOINT_INTERVAL", "500"))
+        self.checkpoint_max_age = float(os.getenv("CHECKPOINT_MAX_AGE", "24"))
+        self.state_chunk_size = int(os.getenv("STATE_CHUNK_SIZE", "500"))
+        self.rebaseline = os.getenv("REBASELINE", "False").lower() in ["true", "1"]
+        self.full_purge_interval = float(os.getenv("FULL_PURGE_INTERVAL", "24"))
+        self.full_purge = True
+        self.full_purge_done = False
         self.new_event_count = 0
         self.updated_event_count = 0
         self.deleted_event_count = 0
         self.unchanged_event_count = 0
+        self.failed_event_count = 0
+        self.unknown_entities_event_count = 0
         self.uids_in_run = set()
         self.urls_in_run = set()
-        self.place_hashes = set()
-        self.organizer_hashes = set()
+        self.place_keys_in_run = set()
+        self.organizer_keys_in_run = set()
+        self.resumed = False
+        self.checkpointed_urls = set()
+        self.checkpointed_place_keys = set()
+        self.checkpointed_organizer_keys = set()
+        self.completed_urls = list()
+        self.completed_uids = list()
+        self.pending_lastmods = dict()
+        self.entity_locks = dict()
+        self.entity_locks_lock = threading.Lock()
+        self.resolved_entities = dict()
+        self.resolution_stats = Counter()
         self.categories = dict()
-        self.event_type_mapping = {
-            "ChildrensEvent": "Family",
-            "ComedyEvent": "Comedy",
-            "DanceEvent": "Dance",
-            "EducationEvent": "Lecture",
-            "ExhibitionEvent": "Exhibition",
-            "Festival": "Festival",
-            "FoodEvent": "Dining",
-            "LiteraryEvent": "Book",
-            "MusicEvent": "Music",
-            "SportsEvent": "Sports",
-            "TheaterEvent": "Theater",
-        }
-        self.event_status_mapping = {
-            "EventScheduled": "scheduled",
-            "EventCancelled": "cancelled",
-            "EventMovedOnline": "movedOnline",
-            "EventPostponed": "postponed",
-            "EventRescheduled": "rescheduled",
-        }
 
     def run(self):
-        self._start_run()
-        self._load_categories()
-        self._import_events_from_sitemap()
-        self._purge_events()
-        self._purge_places()
-        self._purge_organizers()
-        self._finish_run()
+        try:
+            with self.redis_writer:
+                self._start_run()
+
+                if self.rebaseline:
+                    self._rebaseline()
+                    return
+
+                if self._import_events_from_sitemap():
+                    with metrics.timer("stage", stage="purge"):
+                        self._purge_events()
+
+                        # Places and organizers are only purged with all
+                        # events, when every event of the run reported them.
+                        if self.full_purge and self._knows_all_entities():
+                            self._purge_places()
+                            self._purge_organizers()
+
+                self._finish_run()
+        finally:
+            self._write_run_report()
 
     def _start_run(self):
-        self.start_time = now
+        self.start_time = datetime.datetime.now(tz=berlin_tz)
+
+        # Re-baselining goes through every event and is not a regular run
+        if self.rebaseline:
+            return
 
         if r.exists("last_run"):
             last_run_str = r.get("last_run")
             self.last_run = datetime.datetime.fromisoformat(last_run_str)
 
+        self._resume_from_checkpoint()
+        self.full_purge = self._needs_full_purge()
+
+    def _needs_full_purge(self) -> bool:
+        # Otherwise only events of URLs removed from the sitemap snapshot are
+        # purged. Everything else, like events whose page now has another
+        # uid, is left to the next full purge.
+        if self.resumed or not self.last_run or not r.exists("sitemap_snapshot"):
+            return True
+
+        last_full_purge_str = r.get("last_full_purge")
+
+        if not last_full_purge_str:
+            return True
+
+        last_full_purge = datetime.datetime.fromisoformat(last_full_purge_str)
+        max_age = datetime.timedelta(hours=self.full_purge_interval)
+        return self.start_time - last_full_purge >= max_age
+
+    def _resume_from_checkpoint(self):
+        checkpoint = r.hgetall("checkpoint")
+
+        if not checkpoint:
+            return
+
+        start_time = datetime.datetime.fromisoformat(checkpoint["start_time"])
+        max_age = datetime.timedelta(hours=self.checkpoint_max_age)
+
+        if self.start_time - start_time > max_age:
+            logger.info(f"Discarding checkpoint of run from {start_time}.")
+            self._delete_checkpoint()
+            return
+
+        # Continue the interrupted run. Its start time becomes last_run, so
+        # that changes made while it was interrupted are picked up next time.
+        self.resumed = True
+        self.start_time = start_time
+        self.checkpointed_urls = r.smembers("checkpoint_urls")
+        self.checkpointed_place_keys = r.smembers("checkpoint_place_keys")
+        self.checkpointed_organizer_keys = r.smembers("checkpoint_organizer_keys")
+        self.urls_in_run.update(self.checkpointed_urls)
+        self.uids_in_run.update(r.smembers("checkpoint_uids"))
+        self.place_keys_in_run.update(self.checkpointed_place_keys)
+        self.organizer_keys_in_run.update(self.checkpointed_organizer_keys)
+        self.unchanged_event_count = int(checkpoint.get("unchanged", 0))
+        self.new_event_count = int(checkpoint.get("new", 0))
+        self.updated_event_count = int(checkpoint.get("updated", 0))
+        self.unknown_entities_event_count = int(checkpoint.get("unknown_entities", 0))
+
+        logger.info(
+            f"Resuming run from {start_time} with {len(self.checkpointed_urls)} events already processed."
+        )
+
+    def _complete_event(self, url: str, uid: str = None):
+        # Only events that are completely written are added to the checkpoint.
+        # Everything else is fetched again when an interrupted run is resumed.
+        self._update_sitemap_snapshot(url)
+        self.completed_urls.append(url)
+
+        if uid:
+            self.completed_uids.append(uid)
+
+        if (
+            self.checkpoint_interval > 0
+            and len(self.completed_urls) >= self.checkpoint_interval
+        ):
+            self._write_checkpoint()
+
+    def _write_checkpoint(self):
+        # Copies are taken because write threads may add keys meanwhile
+        place_keys = self.place_keys_in_run.copy()
+        organizer_keys = self.organizer_keys_in_run.copy()
+
+        self.redis_writer.sadd("checkpoint_urls", *self.completed_urls)
+        self.redis_writer.sadd("checkpoint_uids", *self.completed_uids)
+        self.redis_writer.sadd(
+            "checkpoint_place_keys", *(place_keys - self.checkpointed_place_keys)
+        )
+        self.redis_writer.sadd(
+            "checkpoint_organizer_keys",
+            *(organizer_keys - self.checkpointed_organizer_keys),
+        )
+        self.redis_writer.hset(
+            "checkpoint",
+            mapping={
+                "start_time": self.start_time.isoformat(),
+                "unchanged": self.unchanged_event_count,
+                "new": self.new_event_count,
+                "updated": self.updated_event_count,
+                "unknown_entities": self.unknown_entities_event_count,
+            },
+        )
+        self.redis_writer.flush()
+
+        self.checkpointed_place_keys = place_keys
+        self.checkpointed_organizer_keys = organizer_keys
+        self.completed_urls = list()
+        self.completed_uids = list()
+        metrics.increment("checkpoints")
+
+    def _delete_checkpoint(self):
+        self.redis_writer.delete(
+            "checkpoint",
+            "checkpoint_urls",
+            "checkpoint_uids",
+            "checkpoint_place_keys",
+            "checkpoint_organizer_keys",
+        )
+
     def _finish_run(self):
         last_run_str = self.start_time.isoformat()
-        r.set("last_run", last_run_str)
+        self.redis_writer.set("last_run", last_run_str)
+        self._delete_checkpoint()
 
+        # Not after runs without purge, e.g. because the sitemap was unchanged
+        if self.full_purge_done:
+            self.redis_writer.set("last_full_purge", last_run_str)
+
+        logger.info(
+            f"Events: {self.unchanged_event_count} unchanged, {self.new_event_count} new, {self.updated_event_count} updated, {self.deleted_event_count} deleted, {self.failed_event_count} failed"
+        )
+
+        stats = self.resolution_stats
         logger.info(
-            f"Events: {self.unchanged_event_count} unchanged, {self.new_event_count} new, {self.updated_event_count} updated, {self.deleted_event_count} deleted"
+            f"Places: {stats['place_hits']} cache hits, {stats['place_misses']} misses. Organizers: {stats['organizer_hits']} cache hits, {stats['organizer_misses']} misses"
         )
 
-    def _import_events_from_sitemap(self):
-        sitememap_urls = self.harzinfo_loader.load_sitemap()
+        connection_stats = self.harzinfo_loader.connection_stats()
+        logger.info(
+            f"Harzinfo: {connection_stats['requests']} requests over {connection_stats['connections']} connections"
+        )
+
+        for name, stats in limiters.stats().items():
+            logger.info(
+                f"Limits of {name}: {stats['concurrency']} concurrent requests, {stats['rate']:.1f} requests/s"
+            )
+
+    def _write_run_report(self):
+        for result in ["unchanged", "new", "updated", "deleted", "failed"]:
+            count = getattr(self, f"{result}_event_count")
+            metrics.set_gauge("events", count, result=result)
+
+        for key, count in self.resolution_stats.items():
+            entity_type, result = key.split("_")
+            metrics.set_gauge(
+                "resolution_cache", count, type=entity_type, result=result
+            )
+
+        connection_stats = self.harzinfo_loader.connection_stats()
+        metrics.set_gauge("harzinfo_connections", connection_stats["connections"])
+        metrics.set_gauge("harzinfo_connection_requests", connection_stats["requests"])
+
+        if self.harzinfo_loader.page_cache:
+            metrics.set_gauge("page_cache_bytes", self.harzinfo_loader.page_cache.size)
+
+        for name, stats in limiters.stats().items():
+            metrics.set_gauge(
+                "rate_limit_concurrency", stats["concurrency"], limiter=name
+            )
+            metrics.set_gauge("rate_limit_rate", stats["rate"], limiter=name)
+
+        try:
+            metrics.write_reports()
+        except Exception:
+            logger.error("Run report Exception", exc_info=True)
+
+    def _load_stored_state(self):
+        # Loaded like categories and indexes once the sitemap changed, so
+        # that a run without changes costs no more than the sitemap request.
+        self.stored_event_mapping = self._load_hash("event_mapping")
+        self.stored_event_hashes = self._load_hash("event_hashes")
+        self.stored_event_field_hashes = self._load_hash("event_field_hashes")
+        self.stored_event_entities = self._load_hash("event_entities")
+        self.stored_url_mapping = self._load_hash("url_mapping")
+        self.stored_url_validators = self._load_hash("url_validators")
+        self.stored_place_mapping = self._load_hash("place_mapping")
+        self.stored_place_hashes = self._load_hash("place_hashes")
+        self.stored_organizer_mapping = self._load_hash("organizer_mapping")
+        self.stored_organizer_hashes = self._load_hash("organizer_hashes")
+        self.stored_sitemap_snapshot = self._load_hash("sitemap_snapshot")
+
+    def _load_hash(self, name: str):
+        return load_hash(name)
+
+    def _import_events_from_sitemap(self) -> bool:
+        validators = None
+
+        # A resumed run has to go through the sitemap even if it did not change
+        if self.last_run and not self.resumed:
+            validators = self._load_validators(r.get("sitemap_validators"))
 
-        for url, lastmod in sitememap_urls.items():
+        try:
+            with metrics.timer("stage", stage="sitemap_open"):
+                sitememap_urls, sitemap_validators = self.harzinfo_loader.load_sitemap(
+                    validators
+                )
+        except PageNotModified:
+            logger.info("Sitemap was not modified since last run. Nothing to do.")
+            return False
+
+        self._load_categories()
+        self._load_indexes()
+        self._load_stored_state()
+
+        with metrics.timer("stage", stage="import"):
+            self._import_events(sitememap_urls)
+
+        # Failed events have to be retried, so the sitemap may only be
+        # skipped next time if every event of this run went through.
+        if self.failed_event_count == 0 and sitemap_validators:
+            self.redis_writer.set("sitemap_validators", json.dumps(sitemap_validators))
+        else:
+            self.redis_writer.delete("sitemap_validators")
+
+        return True
+
+    def _rebaseline(self):
+        # Every page is downloaded and no API call or checkpoint is made.
+        # last_run, validators and the purge are left to the next regular run.
+        self.checkpoint_interval = 0
+        sitememap_urls, _ = self.harzinfo_loader.load_sitemap()
+        self._load_categories()
+        self._load_stored_state()
+
+        with metrics.timer("stage", stage="rebaseline"):
+            self._import_events(sitememap_urls)
+
+        logger.info(
+            f"Rebaseline: {self.updated_event_count} hashes replaced, {self.unchanged_event_count} kept, {self.failed_event_count} failed"
+        )
+
+    def _import_events(self, sitememap_urls):
+        # Pages are fetched and parsed by one pool and written to the API by
+        # another. Fetched pages are checked one by one in sitemap order, so
+        # that duplicate detection and the counters are only ever touched by
+        # this thread.
+        fetches = deque()
+        writes = deque()
+
+        with self._open_page_processor(), ThreadPoolExecutor(
+            max_workers=self.fetch_workers
+        ) as fetch_executor, ThreadPoolExecutor(
+            max_workers=self.api_workers
+        ) as write_executor:
+            submit_write = functools.partial(write_executor.submit, self._write_event)
+
+            for url, lastmod in self._prefetch_stored_state(sitememap_urls):
+                if not self._needs_fetch(url, lastmod):
+                    continue
+
+                future = fetch_executor.submit(self._load_event, url)
+                fetches.append((url, future))
+                self._process_pending_events(
+                    fetches,
+                    self._get_max_fetches(),
+                    writes,
+                    self.api_workers * 2,
+                    submit_write,
+                )
+
+            self._process_pending_events(fetches, 0, writes, 0, submit_write)
+
+    @contextlib.contextmanager
+    def _open_page_processor(self):
+        # With CPU_WORKERS, pages are parsed and hashed in worker processes
+        # instead of the fetch threads.
+        if self.cpu_workers <= 0:
+            yield None
+            return
+
+        with PageProcessor(
+            self.cpu_workers,
+            self.cpu_batch_size,
+            self.harzinfo_loader.parser,
+            self.event_mapper.categories,
+        ) as self.page_processor:
             try:
-                self._import_event_from_sitemap(url, lastmod)
-            except Exception:
-                logger.error(f"Event Exception {url}", exc_info=True)
+                yield self.page_processor
+            finally:
+                self.page_processor = None
+
+    def _get_max_fetches(self) -> int:
+        # Enough pages in flight to fill a batch for every worker process
+        if self.page_processor:
+            return max(self.fetch_workers, self.cpu_workers * self.cpu_batch_size) * 2
+
+        return self.fetch_workers * 2
+
+    def _prefetch_stored_state(self, sitememap_urls):
+        # Looks up the stored state of the next URLs with one request per
+        # hash when the state is not loaded completely (STATE_MODE=streaming).
+        chunk = list()
+
+        for url_and_lastmod in sitememap_urls:
+            chunk.append(url_and_lastmod)
+
+            if len(chunk) >= self.state_chunk_size:
+                self._prefetch_chunk(chunk)
+                yield from chunk
+                chunk = list()
+
+        self._prefetch_chunk(chunk)
+        yield from chunk
+
+    def _prefetch_chunk(self, chunk: list):
+        urls = [url for url, _ in chunk]
+        self.stored_url_mapping.prefetch(urls)
+        self.stored_url_validators.prefetch(urls)
+
+        uids = [self.stored_url_mapping.get(url) for url in urls]
+        self.stored_event_mapping.prefetch(uids)
+        self.stored_event_hashes.prefetch(uids)
+        self.stored_event_field_hashes.prefetch(uids)
+        self.stored_event_entities.prefetch(uids)
+        self.stored_sitemap_snapshot.prefetch(urls)
 
-    def _import_event_from_sitemap(self, url: str, lastmod: str):
+    def _needs_fetch(self, url: str, lastmod: str) -> bool:
+        if url in self.checkpointed_urls:
+            return False
+
+        try:
+            return not self._is_unchanged_in_sitemap(url, lastmod)
+        except Exception:
+            self._fail_event(url)
+            return False
+
+    def _is_unchanged_in_sitemap(self, url: str, lastmod: str) -> bool:
         logger.debug(f"Loading event at {url} from {lastmod}")
+        snapshot_lastmod = self.stored_sitemap_snapshot.get(url)
+
+        if lastmod != snapshot_lastmod and not self.rebaseline:
+            self.pending_lastmods[url] = lastmod
+
+        if self.last_run and lastmod and url in self.stored_url_mapping:
+            # The lastmod of the last run is compared before parsing dates
+            if lastmod == snapshot_lastmod:
+                self._skip_unmodified_event(url)
+                return True
+
+            # URLs left out of the snapshot, e.g. after a failed fetch, are
+            # fetched again. Only URLs without any entry fall back to the date.
+            if snapshot_lastmod is not None:
+                return False
 
-        if self.last_run:
             last_modified = datetime.datetime.fromisoformat(lastmod)
             if last_modified < self.last_run:
-                if url in self.stored_url_mapping:
-                    uid = self.stored_url_mapping[url]
-                    logger.debug(
-                        "Event was not modified since last run. Nothing to do."
-                    )
-                    self.uids_in_run.add(uid)
-                    self.urls_in_run.add(url)
-                    self.unchanged_event_count = self.unchanged_event_count + 1
-                    return
+                self._skip_unmodified_event(url)
+                return True
 
-        self._import_event_from_url(url)
+        return False
 
-    def _import_event_from_url(self, url: str) -> int:
+    def _skip_unmodified_event(self, url: str):
+        uid = self.stored_url_mapping[url]
+        logger.debug("Event was not modified since last run. Nothing to do.")
         self.urls_in_run.add(url)
+        self.unchanged_event_count = self.unchanged_event_count + 1
+
+        if uid in NO_EVENT_MARKERS:
+            self._complete_event(url)
+            return
+
+        self._claim_uid(uid)
+        self._mark_stored_entities(uid)
+        self._complete_event(url, uid)
+
+    def _claim_uid(self, uid: str) -> bool:
+        if uid in self.uids_in_run:
+            return False
+
+        self.uids_in_run.add(uid)
+        return True
+
+    def _update_sitemap_snapshot(self, url: str):
+        lastmod = self.pending_lastmods.pop(url, None)
+
+        if lastmod:
+            self.redis_writer.hset("sitemap_snapshot", url, lastmod)
+
+    def _fail_event(self, url: str):
+        logger.error(f"Event Exception {url}", exc_info=True)
+        self.pending_lastmods.pop(url, None)
+        self.urls_in_run.add(url)
+        self.failed_event_count = self.failed_event_count + 1
+
+        # A page that could not be read this time keeps its event
+        uid = self.stored_url_mapping.get(url)
+
+        if uid not in NO_EVENT_MARKERS and uid in self.stored_event_mapping:
+            self._claim_uid(uid)
+            self._mark_stored_entities(uid)
+
+    def _load_event(self, url: str):
+        validators = self._get_page_validators(url)
+        html, validators = self.harzinfo_loader.fetch_event(url, validators)
+        return self._parse_page(html), validators
+
+    def _parse_page(self, html):
+        # Returns a future of the ParsedPage if the page processor is used
+        if self.page_processor:
+            return self.page_processor.submit(html)
+
+        return ParsedPage(self.harzinfo_loader.parse_event(html), None, None)
+
+    def _wait_for_page(self, page) -> ParsedPage:
+        if self.page_processor:
+            return page.result()
+
+        return page
+
+    def _get_page_validators(self, url: str) -> dict:
+        # Only pages that were imported before may be answered with 304
+        if (
+            not self.rebaseline
+            and self.stored_url_mapping.get(url) in self.stored_event_hashes
+        ):
+            return self._load_validators(self.stored_url_validators.get(url))
+
+        return None
+
+    def _load_validators(self, validators_str: str) -> dict:
+        if not validators_str:
+            return None
+
+        return json.loads(validators_str)
+
+    def _process_pending_events(
+        self,
+        fetches: deque,
+        max_fetches: int,
+        writes: deque,
+        max_writes: int,
+        submit_write,
+    ):
+        while len(fetches) > max_fetches:
+            url, future = fetches.popleft()
+            write = self._import_fetched_event(url, future, submit_write)
+
+            if write:
+                writes.append(write)
+
+            while len(writes) > max_writes:
+                self._finish_event_write(*writes.popleft())
+
+        while len(writes) > max_writes:
+            self._finish_event_write(*writes.popleft())
+
+    def _import_fetched_event(self, url: str, future, submit_write) -> tuple:
+        try:
+            page, validators = future.result()
+            page = self._wait_for_page(page)
+        except PageNotModified:
+            self._skip_unmodified_event(url)
+            return None
+        except Exception:
+            self._fail_event(url)
+            return None
+
+        self.urls_in_run.add(url)
+
+        try:
+            write_args = self._check_event_item(url, page)
+        except Exception:
+            self._fail_event(url)
+            return None
+
+        if write_args:
+            write_future = submit_write(*write_args)
+            return url, write_args[1], write_future, validators
+
+        self._store_validators(url, validators)
+        return None
+
+    def _finish_event_write(self, url: str, uid: str, future, validators: dict):
+        try:
+            result = future.result()
+        except Exception:
+            self._fail_event(url)
+            return
+
+        if result == "new":
+            self.new_event_count = self.new_event_count + 1
+        elif result == "updated":
+            self.updated_event_count = self.updated_event_count + 1
+        else:
+            self.unchanged_event_count = self.unchanged_event_count + 1
+
+        self._store_validators(url, validators)
+        self._complete_event(url, uid)
+
+    def _store_validators(self, url: str, validators: dict):
+        if validators and not self.rebaseline:
+            self.redis_writer.hset("url_validators", url, json.dumps(validators))
+
+    def _check_event_item(self, url: str, page: ParsedPage) -> tuple:
+        item = page.item
 
-        # Load event
-        item = self.harzinfo_loader.load_event(url)
         if not item:
             logger.warn("No event data.")
-            r.hset("url_mapping", url, "nodata")
-            return 0
+            self.redis_writer.hset("url_mapping", url, NO_DATA)
+            self._complete_event(url)
+            return None
 
-        if not self._is_url(item["url"]):
+        if not self.event_mapper.is_url(item["url"]):
             logger.warn("Invalid url.")
-            r.hset("url_mapping", url, "invalidurl")
-            return 0
+            self.redis_writer.hset("url_mapping", url, INVALID_URL)
+            self._complete_event(url)
+            return None
 
         # Check for duplicates
         uid = item["identifier"][0]
 
-        if uid in self.uids_in_run:
+        if not self._claim_uid(uid):
             logger.warn(f"Duplicate UID {uid}")
-            return 0
+            self._complete_event(url)
+            return None
 
-        self.uids_in_run.add(uid)
+        # Compare to stored hashes. Only what would be sent to the API is
+        # hashed, so changes of other ld+json fields are ignored.
+        projection = page.projection
+        item_hash = page.item_hash
 
-        # Compare to stored hashes
-        item_hash = self._hash_dict(item)
+        if projection is None:
+            projection = self._build_projection(item)
+            item_hash = self._hash_projection(projection)
+
+        self._record_entities(uid, projection)
         event_id = 0
 
+        if self.rebaseline:
+            self._rebaseline_event(uid, item, item_hash)
+            self._complete_event(url, uid)
+            return None
+
         if uid in self.stored_event_mapping:
             event_id = int(self.stored_event_mapping[uid])
             logger.debug(f"Found event for uid {uid} in mapping: {event_id}.")
 
-            stored_event_hash = self.stored_event_hashes.get(uid, None)
-            if item_hash == stored_event_hash:
+            if self._is_unchanged(
+                "event_hashes", self.stored_event_hashes, uid, projection, item_hash
+            ):
                 logger.debug("Event did not change. Nothing to do.")
                 self.unchanged_event_count = self.unchanged_event_count + 1
-                return event_id
+                self._complete_event(url, uid)
+                return None
 
-        # Organizer
-        organizer_id = self._import_organizer(item)
+        return url, uid, projection, item_hash, event_id
 
-        # Place
-        place_id = self._import_place(item)
+    def _record_entities(self, uid: str, projection: dict):
+        # Stored per event, so that events skipped in later runs still mark
+        # their place and organizer as in use.
+        entities = {
+            "place": projection["place"]["name"],
+            "organizer": projection["organizer"]["name"],
+        }
+        self._add_entity_keys(entities)
+        entities_str = json.dumps(entities, sort_keys=True)
 
-        # Event
-        event = dict()
-        event["external_link"] = item["url"]
-        event["name"] = item["name"]
-        event["start"] = item["startDate"]
-        event["place"] = {"id": place_id}
-        event["organizer"] = {"id": organizer_id}
+        if self.stored_event_entities.get(uid) != entities_str:
+            self.redis_writer.hset("event_entities", uid, entities_str)
 
-        if "description" in item:
-            event["description"] = item["description"]
+    def _mark_stored_entities(self, uid: str):
+        entities_str = self.stored_event_entities.get(uid)
 
-        self._import_event_photo(event, item)
-        self._import_event_status(event, item)
-        self._add_categories(event, item)
-        self._add_tags(event, item)
+        if not entities_str:
+            self.unknown_entities_event_count = self.unknown_entities_event_count + 1
+            return
 
-        if event_id > 0:
-            logger.debug("Event did change. Updating..")
-            self.api_client.update_event(event_id, event)
-            r.hset("event_hashes", uid, item_hash)
-            self.updated_event_count = self.updated_event_count + 1
-        else:
-            logger.debug(f"Event for uid {uid} not in mapping. Inserting..")
-            event_id = self.api_client.insert_event(event)
-            r.hset("event_mapping", uid, event_id)
-            r.hset("event_hashes", uid, item_hash)
-            r.hset("url_mapping", url, uid)
-            self.new_event_count = self.new_event_count + 1
+        self._add_entity_keys(json.loads(entities_str))
 
-        return event_id
+    def _add_entity_keys(self, entities: dict):
+        self.place_keys_in_run.add(entities["place"])
+        self.organizer_keys_in_run.add(entities["organizer"])
 
-    def _import_event_photo(self, event, item) -> str:
-        if "image" not in item:
-            return
+    def _knows_all_entities(self) -> bool:
+        if self.unknown_entities_event_count == 0:
+            return True
 
-        image = item["image"]
+        logger.warning(
+            f"{self.unknown_entities_event_count} skipped events have no stored place and organizer. Not purging places and organizers until a run with REBASELINE=true recorded them."
+        )
+        return False
 
-        if isinstance(image, list) and len(image) == 0:
-            return
+    def _build_projection(self, item: dict) -> dict:
+        return self.event_mapper.build_projection(item)
 
-        first_image = image[0] if isinstance(image, list) else image
+    def _hash_projection(self, projection: dict) -> str:
+        with metrics.timer("hash"):
+            return self.event_mapper.hash_projection(projection)
 
-        if not isinstance(first_image, dict):
+    def _rebaseline_event(self, uid: str, item: dict, item_hash: str):
+        # Events whose ld+json is unchanged since it was sent get the hash of
+        # the projection. Others keep their hash and are updated next run.
+        stored_hash = self.stored_event_hashes.get(uid)
+
+        if uid not in self.stored_event_mapping or stored_hash == item_hash:
+            self.unchanged_event_count = self.unchanged_event_count + 1
             return
 
-        if "url" not in first_image:
+        if not self.fingerprint.matches(item, self._hash_dict(item), stored_hash):
+            logger.debug(f"Event {uid} changed since last run. Keeping its hash.")
+            self.unchanged_event_count = self.unchanged_event_count + 1
             return
 
-        photo = dict()
-        photo["image_url"] = first_image["url"]
+        self.redis_writer.hset("event_hashes", uid, item_hash)
+        self.updated_event_count = self.updated_event_count + 1
 
-        if "contributor" in first_image:
-            photo["copyright_text"] = first_image["contributor"]
+    def _write_event(
+        self, url: str, uid: str, projection: dict, item_hash: str, event_id: int
+    ) -> str:
+        with metrics.timer("event_write"):
+            return self._write_event_to_api(url, uid, projection, item_hash, event_id)
 
-        event["photo"] = photo
+    def _write_event_to_api(
+        self, url: str, uid: str, projection: dict, item_hash: str, event_id: int
+    ) -> str:
+        # Organizer
+        organizer_id = self._import_organizer(projection["organizer"])
 
-    def _import_event_status(self, event, item: dict) -> str:
-        if "eventStatus" in item:
-            eventStatus = item["eventStatus"]
+        # Place
+        place_id = self._import_place(projection["place"])
 
-            if eventStatus in self.event_status_mapping:
-                event["status"] = self.event_status_mapping[eventStatus]
-                return
+        # Event
+        event, field_hashes = self._build_event(projection, organizer_id, place_id)
 
-            if eventStatus == "ausgebucht":
-                event["booked_up"] = True
+        if event_id > 0:
+            result = self._update_event(uid, event_id, event, field_hashes)
+            self._store_event_hashes(uid, item_hash, field_hashes)
+            return result
+        else:
+            logger.debug(f"Event for uid {uid} not in mapping. Inserting..")
+            event_id = self.api_client.insert_event(event)
+            self._store_new_event(url, uid, event_id, item_hash, field_hashes)
+            return "new"
 
-        event["status"] = "scheduled"
+    def _update_event(
+        self, uid: str, event_id: int, event: dict, field_hashes: dict
+    ) -> str:
+        changes = self._get_event_changes(uid, event, field_hashes)
 
-    def _load_categories(self):
-        try:
-            category_list = self.api_client.get_categories()
-            self.categories = {c["name"]: {"id": c["id"]} for c in category_list}
-        except Exception:
-            logger.error("Categories Exception", exc_info=True)
-
-    def _import_organizer(self, item: dict) -> int:
-        organizer_item = item["author"]
+        if changes is None:
+            logger.debug("Event did change. Updating..")
+            self.api_client.update_event(event_id, event)
+            return "updated"
 
-        if len(item["organizer"]) > 0 and item["organizer"][0]:
-            organizer_item = item["organizer"][0]
+        if not changes:
+            logger.debug("Event did not change in the fields sent. Nothing to do.")
+            return "unchanged"
 
-        organizer_name = organizer_item["name"]
+        logger.debug(f"Event did change in {', '.join(changes.keys())}. Patching..")
+        self.api_client.patch_event(event_id, changes)
+        metrics.increment("event_patched_fields", len(changes))
+        return "updated"
 
-        organizer = dict()
-        organizer["name"] = organizer_name
+    def _build_event(self, projection: dict, organizer_id: int, place_id: int):
+        event = dict(projection["event"])
+        event["place"] = {"id": place_id}
+        event["organizer"] = {"id": organizer_id}
 
-        if "url" in organizer_item and self._is_url(organizer_item["url"]):
-            organizer["url"] = organizer_item["url"]
+        field_hashes = {
+            field: self._hash_dict({field: value}) for field, value in event.items()
+        }
 
-        if "email" in organizer_item:
-            organizer["email"] = organizer_item["email"]
+        return event, field_hashes
 
-        if "telephone" in organizer_item:
-            organizer["phone"] = organizer_item["telephone"]
+    def _get_event_changes(self, uid: str, event: dict, field_hashes: dict) -> dict:
+        stored_field_hashes_str = self.stored_event_field_hashes.get(uid)
 
-        if "faxNumber" in organizer_item:
-            organizer["fax"] = organizer_item["faxNumber"]
+        if not stored_field_hashes_str:
+            return None
 
-        if "address" in organizer_item:
-            organizer["location"] = self._import_location(organizer_item["address"])
+        # With fields that are gone now, the whole event has to be sent,
+        # because a PATCH can not remove fields.
+        stored_field_hashes = json.loads(stored_field_hashes_str)
 
-        hash_key = organizer_name
-        organizer_hash = self._hash_dict(organizer)
-        self.organizer_hashes.add(organizer_hash)
+        if stored_field_hashes.keys() - event.keys():
+            return None
 
-        if hash_key in self.stored_organizer_mapping:
-            organizer_id = int(self.stored_organizer_mapping[hash_key])
-            logger.debug(
-                f"Found organizer {organizer_name} in mapping: {organizer_id}."
+        return {
+            field: value
+            for field, value in event.items()
+            if not self.fingerprint.matches(
+                {field: value}, field_hashes[field], stored_field_hashes.get(field)
             )
+        }
 
-            stored_organizer_hash = self.stored_organizer_hashes.get(hash_key, None)
-            if organizer_hash == stored_organizer_hash:
-                logger.debug("Organizer did not change. Nothing to do.")
-            else:
-                logger.debug("Organizer did change. Updating..")
-                self.api_client.update_organizer(organizer_id, organizer)
-                r.hset("organizer_hashes", hash_key, organizer_hash)
-        else:
-            logger.debug(f"Organizer {organizer_name} not in mapping. Inserting..")
-            organizer_id = self.api_client.upsert_organizer(organizer)
-            r.hset("organizer_mapping", hash_key, organizer_id)
-            r.hset("organizer_hashes", hash_key, organizer_hash)
+    def _store_event_hashes(self, uid: str, item_hash: str, field_hashes: dict):
+        self.redis_writer.hset("event_hashes", uid, item_hash)
+        self.redis_writer.hset(
+            "event_field_hashes", uid, json.dumps(field_hashes, sort_keys=True)
+        )
+
+    def _store_new_event(
+        self, url: str, uid: str, event_id: int, item_hash: str, field_hashes: dict
+    ):
+        self.redis_writer.hset("event_mapping", uid, event_id)
+        self._store_event_hashes(uid, item_hash, field_hashes)
+        self.redis_writer.hset("url_mapping", url, uid)
+        # Losing this mapping would insert the event again next run
+        self.redis_writer.flush()
 
-        return organizer_id
+    def _load_categories(self):
+        # Kept between runs in daemon mode
+        if not self.categories:
+            try:
+                category_list = self.api_client.get_categories()
+                self.categories = {c["name"]: {"id": c["id"]} for c in category_list}
+            except Exception:
+                logger.error("Categories Exception", exc_info=True)
 
-    def _import_place(self, item: dict) -> int:
-        place_item = item["location"][0]
-        place_name = place_item["name"]
+        self.event_mapper.categories = self.categories
 
-        place = dict()
-        place["name"] = place_name
-        location = dict()
+    def _load_indexes(self):
+        if not self.preload_index or self.api_client.indexes:
+            return
 
-        if "address" in place_item:
-            location = self._import_location(place_item["address"])
+        try:
+            self.api_client.load_indexes()
+        except Exception:
+            logger.error("Index Exception", exc_info=True)
 
-        if "coordinate" in item:
-            lat_str, lon_str = item["coordinate"].split(",")
-            latitude = float(lat_str)
-            longitude = float(lon_str)
-            if latitude != 0 and longitude != 0:
-                location["latitude"] = latitude
-                location["longitude"] = longitude
+    def _import_organizer(self, organizer: dict) -> int:
+        hash_key = organizer["name"]
+        organizer_hash = self._hash_dict(organizer)
 
-        place["location"] = location
+        return self._resolve_entity("organizer", hash_key, organizer, organizer_hash)
 
-        hash_key = place_name
+    def _import_place(self, place: dict) -> int:
+        hash_key = place["name"]
         place_hash = self._hash_dict(place)
-        self.place_hashes.add(place_hash)
-
-        if hash_key in self.stored_place_mapping:
-            place_id = int(self.stored_place_mapping[hash_key])
-            logger.debug(f"Found place {place_name} in mapping: {place_id}.")
-
-            stored_place_hash = self.stored_place_hashes.get(hash_key, None)
-            if place_hash == stored_place_hash:
-                logger.debug("Place did not change. Nothing to do.")
-            else:
-                logger.debug("Place did change. Updating..")
-                self.api_client.update_place(place_id, place)
-                r.hset("place_hashes", hash_key, place_hash)
-        else:
-            logger.debug(f"Place {place_name} not in mapping. Inserting..")
-            place_id = self.api_client.upsert_place(place)
-            r.hset("place_mapping", hash_key, place_id)
-            r.hset("place_hashes", hash_key, place_hash)
 
-        return place_id
+        return self._resolve_entity("place", hash_key, place, place_hash)
 
-    def _import_location(self, address: dict) -> dict:
-        location = dict()
-        if "streetAddress" in address:
-            location["street"] = address["streetAddress"]
+    def _write_entity(
+        self, entity_type: str, hash_key: str, entity: dict, entity_hash: str
+    ) -> int:
+        entity_id, changed = self._check_entity(
+            entity_type, hash_key, entity, entity_hash
+        )
 
-        if "postalCode" in address:
-            location["postalCode"] = address["postalCode"]
+        if not changed:
+            return entity_id
 
-        if "addressLocality" in address:
-            location["city"] = address["addressLocality"]
+        update, upsert = self._get_entity_writers(self.api_client, entity_type)
+        inserted = entity_id is None
 
-        if "addressCountry" in address:
-            location["country"] = address["addressCountry"]
-        return location
+        if inserted:
+            entity_id = upsert(entity)
+        else:
+            update(entity_id, entity)
+
+        self._store_entity(entity_type, hash_key, entity_id, entity_hash, inserted)
+        return entity_id
+
+    def _check_entity(
+        self, entity_type: str, hash_key: str, entity: dict, entity_hash: str
+    ) -> tuple:
+        # Returns the stored id, None for a new one, and whether it has to be
+        # sent. Shared by both engines.
+        stored_mapping, stored_hashes = self._get_stored_entities(entity_type)
+
+        if hash_key not in stored_mapping:
+            logger.debug(f"{entity_type.capitalize()} {hash_key} not in mapping.")
+            return None, True
+
+        entity_id = int(stored_mapping[hash_key])
+        logger.debug(f"Found {entity_type} {hash_key} in mapping: {entity_id}.")
+
+        if self._is_unchanged(
+            f"{entity_type}_hashes", stored_hashes, hash_key, entity, entity_hash
+        ):
+            logger.debug(f"{entity_type.capitalize()} did not change. Nothing to do.")
+            return entity_id, False
+
+        logger.debug(f"{entity_type.capitalize()} did change. Updating..")
+        return entity_id, True
+
+    def _store_entity(
+        self,
+        entity_type: str,
+        hash_key: str,
+        entity_id: int,
+        entity_hash: str,
+        inserted: bool,
+    ):
+        stored_mapping, stored_hashes = self._get_stored_entities(entity_type)
+
+        if inserted:
+            self.redis_writer.hset(f"{entity_type}_mapping", hash_key, entity_id)
+            stored_mapping[hash_key] = str(entity_id)
+
+        self.redis_writer.hset(f"{entity_type}_hashes", hash_key, entity_hash)
+        stored_hashes[hash_key] = entity_hash
+
+    def _get_stored_entities(self, entity_type: str) -> tuple:
+        if entity_type == "place":
+            return self.stored_place_mapping, self.stored_place_hashes
+
+        return self.stored_organizer_mapping, self.stored_organizer_hashes
+
+    def _get_entity_writers(self, api_client, entity_type: str) -> tuple:
+        if entity_type == "place":
+            return api_client.update_place, api_client.upsert_place
+
+        return api_client.update_organizer, api_client.upsert_organizer
+
+    def _resolve_entity(
+        self, entity_type: str, hash_key: str, entity: dict, entity_hash: str
+    ) -> int:
+        # Each distinct place or organizer is written at most once per run.
+        # The lock makes events that share a new one wait for its insert.
+        cache_key = (entity_type, hash_key, entity_hash)
+
+        with self._get_entity_lock(entity_type, hash_key):
+            entity_id = self.resolved_entities.get(cache_key)
+
+            if entity_id is not None:
+                self._count_resolution(entity_type, "hits")
+                return entity_id
+
+            self._count_resolution(entity_type, "misses")
+            entity_id = self._write_entity(entity_type, hash_key, entity, entity_hash)
+            self.resolved_entities[cache_key] = entity_id
+            return entity_id
+
+    def _get_entity_lock(self, entity_type: str, key: str) -> threading.Lock:
+        with self.entity_locks_lock:
+            return self.entity_locks.setdefault((entity_type, key), threading.Lock())
+
+    def _count_resolution(self, entity_type: str, result: str):
+        with self.entity_locks_lock:
+            self.resolution_stats[f"{entity_type}_{result}"] += 1
 
-    def _add_categories(self, event: dict, item: dict):
-        if "@type" not in item:
+    def _purge_events(self):
+        removed_urls = [
+            url for url, _ in self.stored_sitemap_snapshot.stale_items(self.urls_in_run)
+        ]
+
+        if self.full_purge:
+            stale_events = self.stored_event_mapping.stale_items(self.uids_in_run)
+            stale_urls = {
+                url
+                for url, _ in self.stored_url_mapping.stale_items(self.urls_in_run)
+                + self.stored_url_validators.stale_items(self.urls_in_run)
+            }
+        else:
+            stale_events = self._find_removed_events(removed_urls)
+            stale_urls = set(removed_urls)
+
+        if self.purge_dry_run:
+            for uid, event_id in stale_events:
+                logger.info(f"Dry run: would delete event {event_id} for uid {uid}")
+            logger.info(
+                f"Dry run: would delete {len(stale_events)} events and {len(stale_urls)} urls"
+            )
             return
 
-        event_categories = list()
+        with ThreadPoolExecutor(max_workers=self.purge_workers) as executor:
+            deleted_uids = [
+                uid for uid in executor.map(self._delete_event, stale_events) if uid
+            ]
 
-        for item_type in item["@type"]:
-            if item_type in self.event_type_mapping:
-                category_name = self.event_type_mapping[item_type]
-                if category_name in self.categories:
-                    category = self.categories[category_name]
-                    event_categories.append(category)
+        self.redis_writer.hdel("event_mapping", *deleted_uids)
+        self.redis_writer.hdel("event_hashes", *deleted_uids)
+        self.redis_writer.hdel("event_field_hashes", *deleted_uids)
+        self.redis_writer.hdel("event_entities", *deleted_uids)
+        self.deleted_event_count = self.deleted_event_count + len(deleted_uids)
 
-        if len(event_categories) > 0:
-            event["categories"] = event_categories
+        self.redis_writer.hdel("url_mapping", *stale_urls)
+        self.redis_writer.hdel("url_validators", *stale_urls)
+        self.redis_writer.hdel("sitemap_snapshot", *removed_urls)
+        self.full_purge_done = self.full_purge
 
-    def _add_tags(self, event: dict, item: dict):
-        if "keywords" not in item:
-            return
+    def _find_removed_events(self, removed_urls: list) -> list:
+        self.stored_url_mapping.prefetch(removed_urls)
+        uids = {self.stored_url_mapping.get(url) for url in removed_urls}
+        uids = [uid for uid in uids if uid and uid not in self.uids_in_run]
+        self.stored_event_mapping.prefetch(uids)
+        removed_events = list()
 
-        tags = list()
+        for uid in uids:
+            event_id = self.stored_event_mapping.get(uid)
 
-        for keyword in item["keywords"].split(","):
-            keyword = keyword.strip()
-            if not keyword[0].islower():
-                tags.append(keyword)
+            if event_id:
+                removed_events.append((uid, event_id))
 
-        if len(tags) > 0:
-            event["tags"] = ",".join(tags)
+        return removed_events
 
-    def _purge_events(self):
-        for uid, event_id_str in self.stored_event_mapping.items():
-            if uid in self.uids_in_run:
-                continue
-
-            self.api_client.delete_event(int(event_id_str))
-            r.hdel("event_mapping", uid)
-            r.hdel("event_hashes", uid)
-            self.deleted_event_count = self.deleted_event_count + 1
+    def _delete_event(self, stale_event: tuple) -> str:
+        uid, event_id = stale_event
 
-        for url, uid in self.stored_url_mapping.items():
-            if url in self.urls_in_run:
-                continue
-            r.hdel("url_mapping", url)
+        try:
+            self.api_client.delete_event(int(event_id))
+            return uid
+        except Exception:
+            logger.error(f"Delete Exception {uid}", exc_info=True)
+            return None
 
     def _purge_places(self):
-        for hash_key in self.stored_place_mapping.keys():
-            if hash_key in self.place_hashes:
-                continue
+        stale_keys = [
+            key
+            for key, _ in self.stored_place_mapping.stale_items(self.place_keys_in_run)
+        ]
+
+        if self.purge_dry_run:
+            logger.info(f"Dry run: would remove {len(stale_keys)} place mappings")
+            return
 
-            r.hdel("place_mapping", hash_key)
-            r.hdel("place_hashes", hash_key)
+        self.redis_writer.hdel("place_mapping", *stale_keys)
+        self.redis_writer.hdel("place_hashes", *stale_keys)
 
     def _purge_organizers(self):
-        for hash_key in self.stored_organizer_mapping.keys():
-            if hash_key in self.organizer_hashes:
-                continue
+        stale_keys = [
+            key
+            for key, _ in self.stored_organizer_mapping.stale_items(
+                self.organizer_keys_in_run
+            )
+        ]
+
+        if self.purge_dry_run:
+            logger.info(f"Dry run: would remove {len(stale_keys)} organizer mappings")
+            return
 
-            r.hdel("organizer_mapping", hash_key)
-            r.hdel("organizer_hashes", hash_key)
+        self.redis_writer.hdel("organizer_mapping", *stale_keys)
+        self.redis_writer.hdel("organizer_hashes", *stale_keys)
 
     def _hash_dict(self, item: dict):
-        item_str = json.dumps(item, sort_keys=True, ensure_ascii=True)
-        return hashlib.md5(item_str.encode("utf-8")).hexdigest()
+        with metrics.timer("hash"):
+            return self.fingerprint.hash(item)
+
+    def _is_unchanged(
+        self, hashes_name: str, stored_hashes, key: str, item: dict, item_hash: str
+    ) -> bool:
+        stored_hash = stored_hashes.get(key, None)
+
+        if not self.fingerprint.matches(item, item_hash, stored_hash):
+            return False
+
+        if stored_hash != item_hash:
+            # Stored with the other hash scheme. Only the hash is replaced.
+            self.redis_writer.hset(hashes_name, key, item_hash)
+            stored_hashes[key] = item_hash
+            metrics.increment("hash_migrations", type=hashes_name)
 
-    def _is_url(self, url: str) -> bool:
-        return validators.url(url)
+        return True
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+class Metrics:
+    """Thread-safe counters, gauges and timing histograms of one import run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.counters = dict()
+            self.gauges = dict()
+            self.histograms = dict()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, self._labels_key(labels))
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+
+            if histogram is None:
+                histogram = {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+                self.histograms[key] = histogram
+
+            histogram["count"] = histogram["count"] + 1
+            histogram["sum"] = histogram["sum"] + seconds
+
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] = histogram["buckets"][i] + 1
+
+    def increment(self, name: str, value: int = 1, **labels):
+        key = (name, self._labels_key(labels))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        key = (name, self._labels_key(labels))
+
+        with self.lock:
+            self.gauges[key] = value
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "start_time": self.start_time,
+                "duration_seconds": time.time() - self.start_time,
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.gauges.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": histogram["count"],
+                        "sum": histogram["sum"],
+                        "buckets": dict(zip(map(str, BUCKETS), histogram["buckets"])),
+                    }
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+    def write_reports(self):
+        report_path = os.getenv("RUN_REPORT_PATH")
+        if report_path:
+            self._write_file(report_path, json.dumps(self.report(), indent=2))
+
+        textfile_path = os.getenv("PROMETHEUS_TEXTFILE_PATH")
+        if textfile_path:
+            self._write_file(textfile_path, self.prometheus_text())
+
+    def prometheus_text(self) -> str:
+        report = self.report()
+        prefix = "harzinfo_importer_"
+        lines = list()
+        typed = set()
+
+        def add_type(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for counter in report["counters"]:
+            name = f"{prefix}{counter['name']}_total"
+            add_type(name, "counter")
+            lines.append(
+                f"{name}{self._format_labels(counter['labels'])} {counter['value']}"
+            )
+
+        for gauge in report["gauges"]:
+            name = f"{prefix}{gauge['name']}"
+            add_type(name, "gauge")
+            lines.append(
+                f"{name}{self._format_labels(gauge['labels'])} {gauge['value']}"
+            )
+
+        for histogram in report["histograms"]:
+            name = f"{prefix}{histogram['name']}_seconds"
+            labels = histogram["labels"]
+            add_type(name, "histogram")
+
+            for bound, count in histogram["buckets"].items():
+                bucket_labels = self._format_labels(dict(labels, le=bound))
+                lines.append(f"{name}_bucket{bucket_labels} {count}")
+
+            inf_labels = self._format_labels(dict(labels, le="+Inf"))
+            lines.append(f"{name}_bucket{inf_labels} {histogram['count']}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {histogram['sum']}")
+            lines.append(
+                f"{name}_count{self._format_labels(labels)} {histogram['count']}"
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def _labels_key(self, labels: dict) -> tuple:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _format_labels(self, labels: dict) -> str:
+        if not labels:
+            return ""
+
+        pairs = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        return "{" + pairs + "}"
+
+    def _write_file(self, path: str, content: str):
+        # Write to a temporary file first so that readers never see a partial file
+        tmp_path = f"{path}.tmp"
+
+        with open(tmp_path, "w") as report_file:
+            report_file.write(content)
+
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from project import logger
+from project.metrics import metrics
+
+CachedPage = namedtuple("CachedPage", ["url", "digest", "validators", "fetched_at"])
+
+
+class PageNotCached(Exception):
+    pass
+
+
+class PageCache:
+    """Downloaded pages in one SQLite file.
+
+    Page contents are stored zlib-compressed once per BLAKE2b digest, pages
+    map a URL to a digest and the validators it was served with. The least
+    recently used pages are evicted once the contents exceed
+    PAGE_CACHE_MAX_SIZE megabytes. In replay mode the file is opened
+    read-only and nothing is downloaded.
+    """
+
+    def __init__(self):
+        self.path = os.getenv("PAGE_CACHE_PATH")
+        self.max_size = int(float(os.getenv("PAGE_CACHE_MAX_SIZE", "512")) * 1024 ** 2)
+        self.replay = os.getenv("PAGE_CACHE_MODE", "readwrite").lower() == "replay"
+        self.lock = threading.Lock()
+        self.connection = self._connect()
+        self.size = self._load_size()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.replay:
+            return sqlite3.connect(
+                f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+            )
+
+        directory = os.path.dirname(self.path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS contents (
+                digest TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                validators TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at);
+            CREATE INDEX IF NOT EXISTS pages_digest ON pages (digest);
+            """
+        )
+        return connection
+
+    def _load_size(self) -> int:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM contents"
+            ).fetchone()
+
+        return row[0]
+
+    def get(self, url: str) -> CachedPage:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT url, digest, validators, fetched_at FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return CachedPage(row[0], row[1], json.loads(row[2]), row[3])
+
+    def read(self, page: CachedPage) -> bytes:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM contents WHERE digest = ?", (page.digest,)
+            ).fetchone()
+
+            if row is None:
+                raise PageNotCached(page.url)
+
+            if not self.replay:
+                self.connection.execute(
+                    "UPDATE pages SET accessed_at = ? WHERE url = ?",
+                    (time.time(), page.url),
+                )
+                self.connection.commit()
+
+        return zlib.decompress(row[0])
+
+    def put(self, url: str, data: bytes, validators: dict) -> CachedPage:
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        now = time.time()
+
+        with self.lock:
+            exists = self.connection.execute(
+                "SELECT 1 FROM contents WHERE digest = ?", (digest,)
+            ).fetchone()
+
+            if not exists:
+                compressed = zlib.compress(data)
+                self.connection.execute(
+                    "INSERT INTO contents (digest, data, size) VALUES (?, ?, ?)",
+                    (digest, compressed, len(compressed)),
+                )
+                self.size = self.size + len(compressed)
+
+            replaced = self.connection.execute(
+                "SELECT digest FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages (url, digest, validators, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (url, digest, json.dumps(validators or dict()), now, now),
+            )
+
+            if replaced and replaced[0] != digest:
+                self._delete_unused_contents([replaced[0]])
+
+            if self.size > self.max_size:
+                self._evict()
+
+            self.connection.commit()
+
+        metrics.set_gauge("page_cache_bytes", self.size)
+        return CachedPage(url, digest, validators or dict(), now)
+
+    def touch(self, page: CachedPage) -> CachedPage:
+        now = time.time()
+
+        with self.lock:
+            self.connection.execute(
+                "UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?",
+                (now, now, page.url),
+            )
+            self.connection.commit()
+
+        return page._replace(fetched_at=now)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def _evict(self):
+        # Remove the least recently used pages until a tenth is free again
+        target_size = self.max_size * 0.9
+        evicted = 0
+
+        while self.size > target_size:
+            rows = self.connection.execute(
+                "SELECT url, digest FROM pages ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+
+            if not rows:
+                break
+
+            self.connection.executemany(
+                "DELETE FROM pages WHERE url = ?", [(row[0],) for row in rows]
+            )
+            self._delete_unused_contents(set(row[1] for row in rows))
+            evicted = evicted + len(rows)
+
+        metrics.increment("page_cache_evictions", evicted)
+        logger.debug(f"Evicted {evicted} pages from page cache")
+
+    def _delete_unused_contents(self, digests):
+        for digest in digests:
+            used = self.connection.execute(
+                "SELECT 1 FROM pages WHERE digest = ? LIMIT 1", (digest,)
+            ).fetchone()
+
+            if used:
+                continue
+
+            row = self.connection.execute(
+                "SELECT size FROM contents WHERE digest = ?", (digest,)
+            ).fetchone()
+
+            if row:
+                self.connection.execute(
+                    "DELETE FROM contents WHERE digest = ?", (digest,)
+                )
+                self.size = self.size - row[0]
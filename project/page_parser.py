@@ -0,0 +1,167 @@
+import json
+from html.parser import HTMLParser
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class EventPageParser(HTMLParser):
+    """Picks the ld+json script and the data-position div out of an event page.
+
+    Only the two elements the importer needs are looked at and parsing stops
+    as soon as both have been found, so no document tree is ever built.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.ld_json_string = None
+        self.coordinate = None
+        self._in_ld_json = False
+        self._ld_json_parts = list()
+
+    def parse(self, html):
+        if isinstance(html, bytes):
+            html = html.decode("utf-8", errors="replace")
+
+        try:
+            self.feed(html)
+            self.close()
+        except _StopParsing:
+            pass
+
+        return self.ld_json_string, self.coordinate
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "script" and self.ld_json_string is None:
+            if ("type", "application/ld+json") in attrs:
+                self._in_ld_json = True
+        elif tag == "div" and self.coordinate is None:
+            for name, value in attrs:
+                if name == "data-position":
+                    self.coordinate = value or ""
+                    self._stop_if_done()
+                    break
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self._in_ld_json:
+            self._in_ld_json = False
+            self.ld_json_string = "".join(self._ld_json_parts)
+            self._stop_if_done()
+
+    def handle_data(self, data):
+        if self._in_ld_json:
+            self._ld_json_parts.append(data)
+
+    def _stop_if_done(self):
+        if self.ld_json_string is not None and self.coordinate is not None:
+            raise _StopParsing()
+
+
+class TextParser(HTMLParser):
+    """Returns the text of an HTML snippet with <br> tags turned into newlines."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts = list()
+        self._skip_depth = 0
+
+    def parse(self, html: str) -> str:
+        self.feed(html)
+        self.close()
+        return "".join(self._parts)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "br":
+            self._parts.append("\n")
+        elif tag in self.CDATA_CONTENT_ELEMENTS:
+            self._skip_depth = self._skip_depth + 1
+
+    def handle_endtag(self, tag):
+        if tag in self.CDATA_CONTENT_ELEMENTS and self._skip_depth > 0:
+            self._skip_depth = self._skip_depth - 1
+
+    def handle_data(self, data):
+        if self._skip_depth == 0:
+            self._parts.append(data)
+
+
+class EventParser:
+    """Returns the stripped ld+json of an event page with the coordinate.
+
+    HARZINFO_PARSER=bs4 uses BeautifulSoup instead of the parsers above.
+    """
+
+    def __init__(self, parser: str = "fast"):
+        self.parser = parser
+
+    def parse(self, html):
+        if self.parser == "bs4":
+            ld_json_string, coordinate = self._extract_event_with_bs4(html)
+        else:
+            ld_json_string, coordinate = EventPageParser().parse(html)
+
+        if ld_json_string is None:
+            raise ValueError("No ld+json found")
+
+        ld_json_array = json.loads(ld_json_string)
+
+        if not ld_json_array:
+            return None
+
+        if len(ld_json_array) == 0:
+            return None
+
+        ld_json = ld_json_array[0]
+        ld_json = self._strip_ld_json(ld_json)
+
+        if "description" in ld_json:
+            ld_json["description"] = self._description_to_text(ld_json["description"])
+
+        if coordinate is not None:
+            ld_json["coordinate"] = coordinate
+
+        return ld_json
+
+    def _extract_event_with_bs4(self, html):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, features="html.parser")
+        ld_json_script = soup.find("script", {"type": "application/ld+json"})
+        ld_json_string = ld_json_script.string if ld_json_script else None
+        coordinate = None
+
+        coordinate_div = soup.find("div", attrs={"data-position": True})
+        if coordinate_div:
+            coordinate = coordinate_div["data-position"]
+
+        return ld_json_string, coordinate
+
+    def _description_to_text(self, description: str) -> str:
+        if self.parser == "bs4":
+            from bs4 import BeautifulSoup
+
+            desc_soup = BeautifulSoup(description, features="html.parser")
+            for br in desc_soup.find_all("br"):
+                br.replace_with("\n" + br.text)
+            return desc_soup.text
+
+        return TextParser().parse(description)
+
+    def _strip_ld_json(self, value: any) -> any:
+        if isinstance(value, str):
+            return value.strip()
+
+        if isinstance(value, dict):
+            result = dict()
+            for k, v in value.items():
+                result[k] = self._strip_ld_json(v)
+            return result
+
+        if isinstance(value, list):
+            result = list()
+            for elem in value:
+                result.append(self._strip_ld_json(elem))
+            return result
+
+        return value
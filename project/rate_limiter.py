@@ -0,0 +1,286 @@
+import email.utils
+import os
+import threading
+import time
+from typing import Awaitable, Callable
+from urllib.parse import urlparse
+
+from project import logger
+from project.metrics import metrics
+
+THROTTLE_STATUS_CODES = [429, 503]
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 1.0
+ASYNC_POLL_INTERVAL = 0.01
+
+
+def _parse_retry_after(value: str) -> float:
+    if not value:
+        return None
+
+    if value.strip().isdigit():
+        return float(value)
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(retry_at.timestamp() - time.time(), 0)
+
+
+class HostLimiter:
+    """Token bucket and adaptive concurrency limit of one host.
+
+    At most max_concurrency requests are in flight and at most rate_limit
+    requests are started per second (0 disables the bucket). The limits are
+    halved on 429 and 503 responses, on responses slower than latency_target
+    and on failed requests, and raised step by step again while responses
+    are healthy. Throttled requests are retried after Retry-After or an
+    exponential backoff.
+    """
+
+    def __init__(self, host: str, prefix: str, default_concurrency: int):
+        self.host = host
+        self.name = f"{prefix.lower()}:{host}"
+        self.rate_limit = float(os.getenv(f"{prefix}_RATE_LIMIT", "0"))
+        self.burst = float(os.getenv(f"{prefix}_BURST", str(max(self.rate_limit, 1))))
+        self.max_concurrency = int(
+            os.getenv(f"{prefix}_MAX_CONCURRENCY", str(default_concurrency))
+        )
+        self.latency_target = float(os.getenv(f"{prefix}_LATENCY_TARGET", "5"))
+        # Separate from the retries of the harzinfo.de session, which do not
+        # cover 429 and 503
+        self.retries = int(os.getenv(f"{prefix}_THROTTLE_RETRIES", "3"))
+        self.backoff = float(os.getenv(f"{prefix}_THROTTLE_BACKOFF", "0.5"))
+
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.concurrency = self.max_concurrency
+        self.rate = self.rate_limit
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.healthy_responses = 0
+        self.blocked_until = 0.0
+        self.last_refill = time.monotonic()
+        self.last_decrease = 0.0
+        self._set_gauges()
+
+    def request(self, send: Callable):
+        for attempt in range(self.retries + 1):
+            self.acquire()
+            start = time.monotonic()
+
+            try:
+                response = send()
+            except Exception:
+                # Connection errors and timeouts count as throttling
+                self.release(failed=True)
+                raise
+
+            if not self._release_response(response, start, attempt):
+                return response
+
+            response.close()
+
+        return response
+
+    async def request_async(self, send: Callable[[], Awaitable]):
+        for attempt in range(self.retries + 1):
+            await self.acquire_async()
+            start = time.monotonic()
+
+            try:
+                response = await send()
+            except Exception:
+                # Connection errors and timeouts count as throttling
+                self.release(failed=True)
+                raise
+
+            if not self._release_response(response, start, attempt):
+                return response
+
+            await response.aclose()
+
+        return response
+
+    def acquire(self):
+        start = time.monotonic()
+
+        with self.condition:
+            while True:
+                wait = self._try_acquire()
+
+                if wait == 0:
+                    break
+
+                self.condition.wait(wait)
+
+        self._observe_wait(start)
+
+    async def acquire_async(self):
+        # Imported here, because only the async engine needs it
+        import asyncio
+
+        start = time.monotonic()
+
+        while True:
+            with self.lock:
+                wait = self._try_acquire()
+
+            if wait == 0:
+                break
+
+            await asyncio.sleep(wait or ASYNC_POLL_INTERVAL)
+
+        self._observe_wait(start)
+
+    def release(
+        self, throttled: bool = False, slow: bool = False, failed: bool = False
+    ):
+        with self.condition:
+            self.in_flight = self.in_flight - 1
+
+            if throttled or slow or failed:
+                self._decrease()
+            else:
+                self._increase()
+
+            self.condition.notify_all()
+
+    def _release_response(self, response, start: float, attempt: int) -> bool:
+        # Returns whether the request was throttled and should be retried
+        latency = time.monotonic() - start
+        throttled = response.status_code in THROTTLE_STATUS_CODES
+        self.release(throttled=throttled, slow=latency > self.latency_target)
+
+        if not throttled:
+            return False
+
+        metrics.increment(
+            "rate_limit_throttled", limiter=self.name, status=response.status_code
+        )
+
+        if attempt >= self.retries:
+            return False
+
+        delay = _parse_retry_after(response.headers.get("Retry-After"))
+
+        if delay is None:
+            delay = self.backoff * (2 ** attempt)
+
+        logger.warning(
+            f"{self.host} answered {response.status_code}. Retrying in {delay:.1f}s.."
+        )
+        self._block(delay)
+        return True
+
+    def _try_acquire(self) -> float:
+        # Returns 0 if a request may be sent, otherwise the seconds to wait
+        # or None to wait for a request in flight to finish.
+        now = time.monotonic()
+
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        if self.in_flight >= self.concurrency:
+            return None
+
+        if self.rate > 0:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last_refill) * self.rate
+            )
+            self.last_refill = now
+
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+
+            self.tokens = self.tokens - 1
+
+        self.in_flight = self.in_flight + 1
+        return 0
+
+    def _block(self, delay: float):
+        with self.condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self.condition.notify_all()
+
+    def _increase(self):
+        # Additive increase: one more request in flight after as many healthy
+        # responses as are currently allowed in flight.
+        self.healthy_responses = self.healthy_responses + 1
+
+        if self.healthy_responses < self.concurrency:
+            return
+
+        self.healthy_responses = 0
+
+        if self.concurrency < self.max_concurrency:
+            self.concurrency = self.concurrency + 1
+
+        if self.rate_limit > 0:
+            self.rate = min(self.rate_limit, self.rate + self.rate_limit / 10)
+
+        self._set_gauges()
+
+    def _decrease(self):
+        # Multiplicative decrease, at most once per cooldown so that a burst
+        # of throttled responses does not drop the limits to the minimum.
+        self.healthy_responses = 0
+        now = time.monotonic()
+
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+
+        self.last_decrease = now
+        self.concurrency = max(1, int(self.concurrency * DECREASE_FACTOR))
+
+        if self.rate_limit > 0:
+            self.rate = max(self.rate_limit / 100, self.rate * DECREASE_FACTOR)
+
+        metrics.increment("rate_limit_decreases", limiter=self.name)
+        logger.debug(
+            f"Limits of {self.host} decreased to {self.concurrency} concurrent, {self.rate:.1f}/s"
+        )
+        self._set_gauges()
+
+    def _observe_wait(self, start: float):
+        metrics.observe("rate_limit_wait", time.monotonic() - start, limiter=self.name)
+
+    def _set_gauges(self):
+        metrics.set_gauge("rate_limit_concurrency", self.concurrency, limiter=self.name)
+        metrics.set_gauge("rate_limit_rate", self.rate, limiter=self.name)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"concurrency": self.concurrency, "rate": self.rate}
+
+
+class RateLimiters:
+    """One HostLimiter per service and host, shared within the process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limiters = dict()
+
+    def get(self, url: str, prefix: str, default_concurrency: int) -> HostLimiter:
+        host = urlparse(url).netloc
+        key = (prefix, host)
+
+        with self.lock:
+            limiter = self.limiters.get(key)
+
+            if limiter is None:
+                limiter = HostLimiter(host, prefix, default_concurrency)
+                self.limiters[key] = limiter
+
+            return limiter
+
+    def stats(self) -> dict:
+        with self.lock:
+            limiters = list(self.limiters.values())
+
+        return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+limiters = RateLimiters()
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+
+from project import r
+from project.metrics import metrics
+
+
+class RedisWriter:
+    """Buffers Redis writes and sends them in batches as MULTI/EXEC pipelines.
+
+    A batch is flushed when it reaches REDIS_BATCH_SIZE commands, when the
+    oldest buffered command is older than REDIS_FLUSH_INTERVAL seconds, when
+    flush() is called and when the writer is used as a context manager and
+    the block is left, also on exceptions. See README for what a crash can
+    lose.
+    """
+
+    def __init__(self):
+        self.batch_size = int(os.getenv("REDIS_BATCH_SIZE", "100"))
+        self.flush_interval = float(os.getenv("REDIS_FLUSH_INTERVAL", "5"))
+        self.chunk_size = 1000
+        self.commands = list()
+        self.first_command_time = None
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def hset(self, name: str, key: str = None, value=None, mapping: dict = None):
+        if mapping:
+            self._add("hset", name, None, None, mapping)
+        else:
+            self._add("hset", name, key, value)
+
+    def hdel(self, name: str, *keys: str):
+        self._add_chunked("hdel", name, keys)
+
+    def sadd(self, name: str, *values: str):
+        self._add_chunked("sadd", name, values)
+
+    def srem(self, name: str, *values: str):
+        self._add_chunked("srem", name, values)
+
+    def hincrby(self, name: str, key: str, amount: int = 1):
+        self._add("hincrby", name, key, amount)
+
+    def lrem(self, name: str, value, count: int = 1):
+        self._add("lrem", name, count, value)
+
+    def set(self, name: str, value):
+        self._add("set", name, value)
+
+    def delete(self, *names: str):
+        self._add("delete", *names)
+
+    def flush(self):
+        with self.lock:
+            if not self.commands:
+                return
+
+            pipeline = r.pipeline(transaction=True)
+
+            for command, args in self.commands:
+                getattr(pipeline, command)(*args)
+
+            with metrics.timer("redis", operation="pipeline"):
+                pipeline.execute()
+
+            metrics.increment("redis_commands", len(self.commands))
+            self.commands = list()
+            self.first_command_time = None
+
+    def _add_chunked(self, command: str, name: str, values):
+        values = list(values)
+
+        for i in range(0, len(values), self.chunk_size):
+            self._add(command, name, *values[i : i + self.chunk_size])
+
+    def _add(self, command: str, *args):
+        with self.lock:
+            if not self.commands:
+                self.first_command_time = time.monotonic()
+
+            self.commands.append((command, args))
+
+            if (
+                len(self.commands) >= self.batch_size
+                or time.monotonic() - self.first_command_time >= self.flush_interval
+            ):
+                self.flush()
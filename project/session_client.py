@@ -1,11 +1,13 @@
 import json
 import os
+import threading
 from typing import Any
 
-from authlib.integrations.requests_client import OAuth2Session
 from requests import Response
 
 from project import logger, r
+from project.metrics import metrics
+from project.rate_limiter import limiters
 
 
 def _update_token(token, refresh_token=None, access_token=None):
@@ -26,6 +28,10 @@ class UnprocessableEntityError(ValueError):
         super().__init__(message)
 
 
+class NotFoundError(ValueError):
+    pass
+
+
 class SessionClient:
     def __init__(self):
         self.base_url = os.getenv("API_URL") + "/api/v1"
@@ -33,7 +39,15 @@ class SessionClient:
         self.client_id = os.getenv("CLIENT_ID")
         self.client_secret = os.getenv("CLIENT_SECRET")
         self.token = self._load_token()
-        self.session = OAuth2Session(
+        self.token_lock = threading.Lock()
+        self.session = self._create_session()
+        self.limiter = limiters.get(self.base_url, "API", 8)
+
+    def _create_session(self):
+        # authlib and cryptography take long to import
+        from authlib.integrations.requests_client import OAuth2Session
+
+        return OAuth2Session(
             self.client_id,
             self.client_secret,
             scope=self.scope,
@@ -56,36 +70,73 @@ class SessionClient:
         if response.status_code == 422:
             raise UnprocessableEntityError(msg, response)
 
+        if response.status_code == 404:
+            raise NotFoundError(msg, response)
+
         raise ValueError(msg, response)
 
     def get(self, url: str) -> Response:
         url = self.complete_url(url)
         logger.debug(f"GET {url}")
-        response = self.session.get(url)
+        response = self._send("GET", url)
         self.status_code_or_raise(response, 200)
         return response
 
     def post(self, url: str, data: Any) -> Response:
         url = self.complete_url(url)
         logger.debug(f"POST {url}\n{json.dumps(data)}")
-        response = self.session.post(url, json=data)
+        response = self._send("POST", url, json=data)
         self.status_code_or_raise(response, 201)
         return response
 
     def put(self, url: str, data: Any) -> Response:
         url = self.complete_url(url)
         logger.debug(f"PUT {url}\n{json.dumps(data)}")
-        response = self.session.put(url, json=data)
+        response = self._send("PUT", url, json=data)
+        self.status_code_or_raise(response, 204)
+        return response
+
+    def patch(self, url: str, data: Any) -> Response:
+        url = self.complete_url(url)
+        logger.debug(f"PATCH {url}\n{json.dumps(data)}")
+        response = self._send("PATCH", url, json=data)
         self.status_code_or_raise(response, 204)
         return response
 
     def delete(self, url: str) -> Response:
         url = self.complete_url(url)
         logger.debug(f"DELETE {url}")
-        response = self.session.delete(url)
+        response = self._send("DELETE", url)
         self.status_code_or_raise(response, 204)
         return response
 
+    def _send(self, method: str, url: str, **kwargs) -> Response:
+        self._ensure_active_token()
+
+        with metrics.timer("api_request", method=method):
+            response = self.limiter.request(
+                lambda: self.session.request(method, url, **kwargs)
+            )
+
+        metrics.increment("api_requests", method=method, status=response.status_code)
+        return response
+
+    def get_active_token(self) -> dict:
+        # The AsyncSessionClient takes its token from here, so that it is
+        # only refreshed by one client
+        self._ensure_active_token()
+        return dict(self.session.token)
+
+    def _ensure_active_token(self):
+        # Requests are sent from several threads, but the token must only be
+        # refreshed once. Otherwise the refresh token would be used twice.
+        with self.token_lock:
+            token = self.session.token
+
+            if token and token.is_expired():
+                self.session.token_auth.ensure_active_token()
+                metrics.increment("api_token_refreshes")
+
     def _load_token(self) -> dict:
         token = r.hgetall("token")
 
@@ -0,0 +1,104 @@
+import os
+import threading
+
+from project import r
+from project.metrics import metrics
+
+_MISSING = object()
+
+
+class EagerHash(dict):
+    """A Redis hash that is completely loaded with HGETALL."""
+
+    def __init__(self, name: str):
+        with metrics.timer("redis", operation="hgetall"):
+            super().__init__(r.hgetall(name))
+
+        self.name = name
+
+    def prefetch(self, keys: list):
+        pass
+
+    def stale_items(self, keys_in_run: set) -> list:
+        return [(key, value) for key, value in self.items() if key not in keys_in_run]
+
+
+class StreamingHash:
+    """A Redis hash that is read on demand.
+
+    Values are looked up with HMGET for a batch of keys by prefetch() or with
+    HGET for a single key and kept in a cache of at most STATE_CACHE_SIZE
+    entries. When the cache is full, the older half is dropped. Values set in
+    memory are kept in the cache as well.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.cache_size = int(os.getenv("STATE_CACHE_SIZE", "20000"))
+        self.cache = dict()
+        self.lock = threading.Lock()
+
+    def prefetch(self, keys: list):
+        keys = [key for key in set(keys) if key is not None and key not in self.cache]
+
+        if not keys:
+            return
+
+        with metrics.timer("redis", operation="hmget"):
+            values = r.hmget(self.name, keys)
+
+        self._cache_values(zip(keys, values))
+
+    def get(self, key: str, default=None):
+        if key is None:
+            return default
+
+        value = self.cache.get(key, _MISSING)
+
+        if value is _MISSING:
+            with metrics.timer("redis", operation="hget"):
+                value = r.hget(self.name, key)
+
+            self._cache_values([(key, value)])
+
+        return default if value is None else value
+
+    def stale_items(self, keys_in_run: set) -> list:
+        with metrics.timer("redis", operation="hscan"):
+            return [
+                (key, value)
+                for key, value in r.hscan_iter(self.name, count=1000)
+                if key not in keys_in_run
+            ]
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __getitem__(self, key: str):
+        value = self.get(key)
+
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key: str, value):
+        self._cache_values([(key, value)])
+
+    def _cache_values(self, items):
+        with self.lock:
+            for key, value in items:
+                self.cache.pop(key, None)
+                self.cache[key] = value
+
+            if len(self.cache) > self.cache_size:
+                # Dicts keep insertion order, so the first keys are the oldest
+                for key in list(self.cache)[: len(self.cache) // 2]:
+                    del self.cache[key]
+
+
+def load_hash(name: str):
+    if os.getenv("STATE_MODE", "eager").lower() == "streaming":
+        return StreamingHash(name)
+
+    return EagerHash(name)